@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Benchmark the MediaProcessor render paths on synthetic media.
+
+    python benchmarks/bench_media_processor.py --output results.json
+    python benchmarks/bench_media_processor.py --baseline results.json --threshold 0.10
+
+Images from 640x480 up to 12 MP and short videos at several lengths and
+frame rates are generated once, then rendered for every watermark
+position/opacity combination. Images are rendered at full resolution and,
+as the bot does by default, downscaled to --max-side (cases named
+"image/<size>@<max-side>/..."). For each case it reports throughput,
+latency percentiles, output size and peak RSS. On Linux the peak is reset
+before each case, so it is that case's own; elsewhere ru_maxrss only
+grows, so the column is the process's peak so far (marked "max").
+
+With --baseline, the p50 latency of each case is compared to an earlier
+--output file. The script exits with status 1 if any case got slower by
+more than --threshold.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+from media_processor import MediaProcessor  # noqa: E402
+
+IMAGE_SIZES = {
+    "640p": (640, 480),
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "4k": (3840, 2160),
+    "12mp": (4000, 3000),
+}
+VIDEO_CASES = {
+    "480p-2s-30fps": ((854, 480), 2, 30),
+    "720p-5s-30fps": ((1280, 720), 5, 30),
+    "720p-5s-60fps": ((1280, 720), 5, 60),
+    "1080p-10s-30fps": ((1920, 1080), 10, 30),
+}
+POSITIONS = ["top_left", "top_right", "bottom_left", "bottom_right", "center"]
+OPACITIES = [64, 128, 255]
+
+
+def synthetic_frame(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """A gradient with noise: compresses like a photo, not like a flat fill."""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    frame = np.empty((height, width, 3), dtype=np.float32)
+    frame[..., 0] = x
+    frame[..., 1] = y
+    frame[..., 2] = (x + y) / 2
+    frame += rng.normal(0, 12, frame.shape).astype(np.float32)
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+def synthetic_jpeg(width: int, height: int) -> bytes:
+    output = io.BytesIO()
+    Image.fromarray(synthetic_frame(width, height)).save(output, format="JPEG", quality=92)
+    return output.getvalue()
+
+
+def synthetic_video(path: str, size: tuple, seconds: int, fps: int) -> str:
+    width, height = size
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    base = synthetic_frame(width, height)
+    for n in range(seconds * fps):
+        # Shift the frame so the encoder sees motion
+        writer.write(np.roll(base, n * 4, axis=1))
+    writer.release()
+    return path
+
+
+def reset_peak_rss() -> bool:
+    """Reset the kernel's peak RSS counter (Linux 4.0+); False if unsupported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb() -> float:
+    """Peak RSS since reset_peak_rss(), or of the whole process if it can't be reset."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if platform.system() == "Darwin" else peak / 1024
+
+
+def percentile(samples: list, pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies: list, units: int, output_size: int, rss_per_case: bool) -> dict:
+    total = sum(latencies)
+    return {
+        'runs': len(latencies),
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p90_ms': percentile(latencies, 90) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'mean_ms': statistics.mean(latencies) * 1000,
+        'throughput': units * len(latencies) / total if total else 0.0,
+        'output_bytes': output_size,
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_rss_scope': "case" if rss_per_case else "process",
+    }
+
+
+def settings_for(position: str, opacity: int) -> dict:
+    settings = dict(config.DEFAULT_WATERMARK_SETTINGS)
+    settings.update(position=position, opacity=opacity)
+    return settings
+
+
+def bench_images(processor: MediaProcessor, sizes: list, combos: list, repeat: int,
+                 max_side: int) -> dict:
+    results = {}
+    for name in sizes:
+        data = synthetic_jpeg(*IMAGE_SIZES[name])
+        for side in (None, max_side):
+            if side is not None and max(IMAGE_SIZES[name]) <= side:
+                continue  # same work as the full resolution case
+            label = name if side is None else f"{name}@{side}"
+            for position, opacity in combos:
+                settings = settings_for(position, opacity)
+                rss_per_case = reset_peak_rss()
+                processor.render_image_bytes(data, settings, side)  # warm the stamp cache
+                latencies = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    output = processor.render_image_bytes(data, settings, side)
+                    latencies.append(time.perf_counter() - start)
+                case = f"image/{label}/{position}/{opacity}"
+                results[case] = summarize(latencies, 1, len(output), rss_per_case)
+                report(case, results[case], "img/s")
+    return results
+
+
+def bench_videos(processor: MediaProcessor, cases: list, combos: list, repeat: int, workdir: str) -> dict:
+    results = {}
+    for name in cases:
+        size, seconds, fps = VIDEO_CASES[name]
+        source = synthetic_video(os.path.join(workdir, f"{name}.mp4"), size, seconds, fps)
+        for position, opacity in combos:
+            settings = settings_for(position, opacity)
+            rss_per_case = reset_peak_rss()
+            latencies = []
+            output_size = 0
+            for _ in range(repeat):
+                start = time.perf_counter()
+                output_path = processor.render_video(source, settings)
+                latencies.append(time.perf_counter() - start)
+                output_size = os.path.getsize(output_path)
+                os.remove(output_path)
+            case = f"video/{name}/{position}/{opacity}"
+            results[case] = summarize(latencies, seconds * fps, output_size, rss_per_case)
+            report(case, results[case], "fps")
+    return results
+
+
+def report(case: str, result: dict, unit: str):
+    rss_label = "rss" if result['peak_rss_scope'] == "case" else "max rss"
+    print(f"{case:<40} p50 {result['p50_ms']:9.1f} ms  p90 {result['p90_ms']:9.1f} ms  "
+          f"p99 {result['p99_ms']:9.1f} ms  {result['throughput']:8.1f} {unit}  "
+          f"{result['output_bytes'] / 1024:8.0f} KiB  {rss_label} {result['peak_rss_mb']:6.0f} MB")
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Cases whose p50 grew by more than threshold relative to the baseline."""
+    regressions = []
+    for case, result in results.items():
+        before = baseline.get(case)
+        if before is None:
+            continue
+        change = result['p50_ms'] / before['p50_ms'] - 1
+        marker = "REGRESSION" if change > threshold else ""
+        print(f"{case:<40} {before['p50_ms']:9.1f} -> {result['p50_ms']:9.1f} ms  {change:+7.1%}  {marker}")
+        if change > threshold:
+            regressions.append(case)
+    return regressions
+
+
+def main(args):
+    if args.video_engine:
+        config.VIDEO_ENGINE = args.video_engine
+    combos = [(p, o) for p in args.positions for o in args.opacities]
+    processor = MediaProcessor()
+    processor.warm_up()
+
+    results = {}
+    workdir = tempfile.mkdtemp(prefix="bench_", dir=config.TEMP_DIR)
+    try:
+        if args.images:
+            results.update(bench_images(processor, args.images, combos, args.repeat, args.max_side))
+        if args.videos:
+            results.update(bench_videos(processor, args.videos, combos, args.video_repeat, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({'results': results, 'machine': platform.platform(),
+                       'cpus': os.cpu_count()}, f, indent=2)
+        print(f"Wrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} case(s) slower than baseline by more than {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", nargs="*", default=list(IMAGE_SIZES), choices=list(IMAGE_SIZES))
+    parser.add_argument("--videos", nargs="*", default=list(VIDEO_CASES), choices=list(VIDEO_CASES))
+    parser.add_argument("--positions", nargs="+", default=POSITIONS, choices=POSITIONS)
+    parser.add_argument("--opacities", nargs="+", type=int, default=OPACITIES)
+    parser.add_argument("--repeat", type=int, default=20, help="runs per image case")
+    parser.add_argument("--max-side", type=int, default=config.PHOTO_MAX_SIDE,
+                        help="delivery size for the downscaled image cases")
+    parser.add_argument("--video-repeat", type=int, default=3, help="runs per video case")
+    parser.add_argument("--video-engine", choices=["ffmpeg", "opencv"], help="override VIDEO_ENGINE")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="compare against an earlier --output file")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed p50 slowdown, e.g. 0.10")
+    sys.exit(main(parser.parse_args()))
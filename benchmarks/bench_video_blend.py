@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Compare the per-frame watermark blend used by MediaProcessor.render_video.
+
+    python benchmarks/bench_video_blend.py --width 1920 --height 1080 --frames 300
+
+"old" is the previous loop (frame.copy + cv2.putText + full-frame
+cv2.addWeighted); "new" is the precomputed VideoStamp blended into the
+text bounding box in place.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from watermark_stamp import VideoStamp  # noqa: E402
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+
+def make_frames(width, height, count):
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(count)]
+
+
+def blend_old(frames, text, org, font_scale, color, opacity):
+    alpha = opacity / 255.0
+    for frame in frames:
+        overlay = frame.copy()
+        cv2.putText(overlay, text, org, FONT, font_scale, color, 2, cv2.LINE_AA)
+        cv2.addWeighted(overlay, alpha, frame, 1 - alpha, 0)
+
+
+def blend_new(frames, text, org, font_scale, color, opacity, size):
+    stamp = VideoStamp(text, org, FONT, font_scale, color, 2, opacity, size)
+    for frame in frames:
+        stamp.apply(frame)
+
+
+def max_difference(frame, text, org, font_scale, color, opacity) -> int:
+    """Largest per-channel difference between the old and new blend of one frame."""
+    height, width = frame.shape[:2]
+    expected = cv2.addWeighted(
+        cv2.putText(frame.copy(), text, org, FONT, font_scale, color, 2, cv2.LINE_AA),
+        opacity / 255.0, frame, 1 - opacity / 255.0, 0,
+    )
+    actual = [frame.copy()]
+    blend_new(actual, text, org, font_scale, color, opacity, (width, height))
+    return int(np.abs(expected.astype(np.int16) - actual[0].astype(np.int16)).max())
+
+
+def run(label, fn, frames, repeat):
+    best = None
+    for _ in range(repeat):
+        work = [f.copy() for f in frames]
+        start = time.perf_counter()
+        fn(work)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    fps = len(frames) / best
+    print(f"{label:>4}: {fps:10.1f} frames/sec ({best * 1000 / len(frames):.3f} ms/frame)")
+    return fps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--frames", type=int, default=120)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--text", default="Watermark")
+    parser.add_argument("--font-size", type=int, default=36)
+    parser.add_argument("--opacity", type=int, default=128)
+    args = parser.parse_args()
+
+    frames = make_frames(args.width, args.height, args.frames)
+    font_scale = args.font_size / 50
+    color = (255, 255, 255)
+    (text_width, text_height), _ = cv2.getTextSize(args.text, FONT, font_scale, 2)
+    org = (args.width - text_width - 20, args.height - text_height - 20)
+
+    # The two paths should produce (almost) identical frames, also when the
+    # text is cut off at the frame edges
+    edge_orgs = [
+        (-text_width // 2, text_height),  # left
+        (args.width - text_width // 2, args.height // 2),  # right
+        (args.width // 2, text_height // 2),  # top
+        (args.width // 2, args.height + text_height // 2),  # bottom
+        (args.width, args.height // 2),  # just past the right edge
+    ]
+    diff = max_difference(frames[0], args.text, org, font_scale, color, args.opacity)
+    edge_diff = max(max_difference(frames[0], args.text, edge_org, font_scale, color, args.opacity)
+                    for edge_org in edge_orgs)
+
+    print(f"{args.width}x{args.height}, {args.frames} frames, max pixel difference {diff} "
+          f"({edge_diff} with the text clipped at the edges)")
+    old_fps = run("old", lambda w: blend_old(w, args.text, org, font_scale, color, args.opacity), frames, args.repeat)
+    new_fps = run("new", lambda w: blend_new(w, args.text, org, font_scale, color, args.opacity,
+                                            (args.width, args.height)), frames, args.repeat)
+    print(f"speed-up: {new_fps / old_fps:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
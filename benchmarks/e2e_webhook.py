@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+End-to-end check of webhook mode against the fake Bot API.
+
+    python benchmarks/e2e_webhook.py
+
+Starts FakeTelegram, runs main.py in webhook mode against it with a
+throwaway SQLite database, then checks that:
+
+- updates without the secret token header, or with a wrong one, get 403;
+- /start with the secret is answered;
+- a photo followed by "Apply Watermark" comes back through sendPhoto or
+  sendDocument.
+
+Exits with status 1 if any check fails.
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from aiohttp import ClientSession
+from PIL import Image
+
+from fake_telegram import FakeTelegram
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRET = "e2e-secret"
+
+
+def synthetic_jpeg(width: int = 1280, height: int = 720) -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), (40, 90, 160)).save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+def start_bot(args, workdir: str) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        TELEGRAM_BOT_TOKEN="123456:e2e",
+        TELEGRAM_BASE_URL=f"http://127.0.0.1:{args.api_port}/bot",
+        TELEGRAM_BASE_FILE_URL=f"http://127.0.0.1:{args.api_port}/file/bot",
+        BOT_MODE="webhook",
+        WEBHOOK_LISTEN="127.0.0.1",
+        WEBHOOK_PORT=str(args.webhook_port),
+        WEBHOOK_SECRET_TOKEN=SECRET,
+        WEBHOOK_URL="",
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'e2e.db')}",
+        METRICS_PORT="0",
+    )
+    return subprocess.Popen([sys.executable, "main.py"], cwd=ROOT, env=env)
+
+
+async def wait_until_healthy(url: str, bot: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    async with ClientSession() as session:
+        while time.monotonic() < deadline:
+            if bot.poll() is not None:
+                raise RuntimeError(f"bot exited with {bot.returncode}")
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200 and (await response.json())['running']:
+                        return
+            except OSError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("bot did not become healthy")
+
+
+async def wait_for_calls(fake: FakeTelegram, methods: tuple, since: int, timeout: float) -> list:
+    """Calls to any of methods made after the first `since` calls."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        calls = [name for name, _ in fake.calls[since:] if name in methods]
+        if calls:
+            return calls
+        await asyncio.sleep(0.1)
+    return []
+
+
+async def post_with_secret(fake: FakeTelegram, update: dict, secret: str) -> int:
+    fake.secret_token = secret
+    try:
+        return await fake.post_update(update)
+    finally:
+        fake.secret_token = SECRET
+
+
+async def run_checks(args, fake: FakeTelegram) -> list:
+    failures = []
+
+    def check(name: str, ok: bool):
+        print(f"{'ok' if ok else 'FAIL':>4}  {name}")
+        if not ok:
+            failures.append(name)
+
+    user = args.user
+    check("update without secret is rejected",
+          await post_with_secret(fake, fake.message_update(user, text="/start"), None) == 403)
+    check("update with wrong secret is rejected",
+          await post_with_secret(fake, fake.message_update(user, text="/start"), "wrong") == 403)
+    check("rejected updates reach no handler", not fake.calls_to("sendMessage"))
+
+    mark = len(fake.calls)
+    check("/start is accepted", await fake.post_update(fake.message_update(user, text="/start")) == 200)
+    check("/start is answered", bool(await wait_for_calls(fake, ("sendMessage",), mark, args.timeout)))
+
+    photo = fake.add_file(synthetic_jpeg())
+    mark = len(fake.calls)
+    check("photo is accepted", await fake.post_update(fake.message_update(user, photo=photo)) == 200)
+    check("photo options are shown", bool(await wait_for_calls(fake, ("sendMessage",), mark, args.timeout)))
+
+    mark = len(fake.calls)
+    check("apply is accepted", await fake.post_update(fake.callback_update(user, "apply_watermark")) == 200)
+    sent = await wait_for_calls(fake, ("sendPhoto", "sendDocument"), mark, args.timeout)
+    check(f"watermarked photo is sent ({', '.join(sent) or 'nothing'})", bool(sent))
+    return failures
+
+
+async def main(args) -> int:
+    fake = FakeTelegram(f"http://127.0.0.1:{args.webhook_port}/telegram", SECRET)
+    await fake.start(port=args.api_port)
+    workdir = tempfile.mkdtemp(prefix="e2e_")
+    bot = start_bot(args, workdir)
+    try:
+        await wait_until_healthy(f"http://127.0.0.1:{args.webhook_port}/healthz", bot, args.timeout)
+        failures = await run_checks(args, fake)
+    finally:
+        bot.terminate()
+        try:
+            bot.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+        await fake.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if failures:
+        print(f"{len(failures)} check(s) failed")
+        return 1
+    print("All checks passed")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api-port", type=int, default=8081, help="port of the fake Bot API")
+    parser.add_argument("--webhook-port", type=int, default=8080, help="port the bot listens on")
+    parser.add_argument("--user", type=int, default=1000)
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds to wait for each reply")
+    sys.exit(asyncio.run(main(parser.parse_args())))
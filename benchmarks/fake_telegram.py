@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Telegram Bot API, for exercising the bot end to end.
+
+Start it, then run the bot against it in webhook mode:
+
+    python benchmarks/fake_telegram.py --port 8081 --webhook http://127.0.0.1:8080/telegram --secret s3cret
+    TELEGRAM_BASE_URL=http://127.0.0.1:8081/bot \\
+    TELEGRAM_BASE_FILE_URL=http://127.0.0.1:8081/file/bot \\
+    BOT_MODE=webhook WEBHOOK_SECRET_TOKEN=s3cret python main.py
+
+FakeTelegram answers the Bot API methods the bot uses with plausible
+objects, records every call, serves registered files for getFile
+downloads, and can post synthetic updates to the bot's webhook.
+benchmarks/e2e_webhook.py uses it to check webhook mode end to end.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import time
+
+from aiohttp import ClientSession, web
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class FakeTelegram:
+    def __init__(self, webhook_url: str = None, secret_token: str = None):
+        self.webhook_url = webhook_url
+        self.secret_token = secret_token
+        self.calls = []
+        self.files = {}
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._runner = None
+        self._session = None
+
+    # --- Bot API side -------------------------------------------------------
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=100 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self._handle_method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self._handle_file)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081):
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self._session = ClientSession()
+
+    async def stop(self):
+        if self._session is not None:
+            await self._session.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def add_file(self, data: bytes) -> tuple:
+        """Register a downloadable file and return its (file_id, file_unique_id)."""
+        number = next(self._file_ids)
+        file_id = f"file{number}"
+        self.files[file_id] = data
+        return file_id, f"unique{number}"
+
+    def calls_to(self, method: str) -> list:
+        return [params for name, params in self.calls if name == method]
+
+    async def _handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        form = await request.post()
+        params = {
+            key: value if isinstance(value, str) else value.file.read()
+            for key, value in form.items()
+        }
+        self.calls.append((method, params))
+        handler = getattr(self, f"_api_{method}", None)
+        result = handler(params) if handler else True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _handle_file(self, request: web.Request) -> web.Response:
+        data = self.files.get(request.match_info["path"])
+        if data is None:
+            return web.Response(status=404)
+        return web.Response(body=data)
+
+    def _message(self, params: dict, **fields) -> dict:
+        chat_id = int(params.get("chat_id", 0))
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            **fields,
+        }
+
+    def _photo(self) -> list:
+        number = next(self._file_ids)
+        return [{"file_id": f"sent{number}", "file_unique_id": f"sentunique{number}",
+                 "width": 1280, "height": 720}]
+
+    def _api_getMe(self, params):
+        return {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+
+    def _api_getFile(self, params):
+        file_id = params["file_id"]
+        data = self.files.get(file_id, b"")
+        return {"file_id": file_id, "file_unique_id": f"u{file_id}",
+                "file_size": len(data), "file_path": file_id}
+
+    def _api_sendMessage(self, params):
+        return self._message(params, text=params.get("text", ""))
+
+    def _api_editMessageText(self, params):
+        return self._message(params, text=params.get("text", ""))
+
+    def _api_sendPhoto(self, params):
+        return self._message(params, photo=self._photo())
+
+    def _api_sendVideo(self, params):
+        number = next(self._file_ids)
+        return self._message(params, video={
+            "file_id": f"sent{number}", "file_unique_id": f"sentunique{number}",
+            "width": 1280, "height": 720, "duration": 1,
+        })
+
+    def _api_sendDocument(self, params):
+        number = next(self._file_ids)
+        return self._message(params, document={
+            "file_id": f"sent{number}", "file_unique_id": f"sentunique{number}",
+            "file_name": "watermarked.jpg", "mime_type": "image/jpeg",
+        })
+
+    def _api_sendMediaGroup(self, params):
+        return [self._message(params, photo=self._photo()) for _ in json.loads(params["media"])]
+
+    # --- Update side --------------------------------------------------------
+
+    def message_update(self, user_id: int, text: str = None, photo: tuple = None,
+                       media_group_id: str = None) -> dict:
+        user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": user,
+        }
+        if text is not None:
+            message["text"] = text
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0,
+                                        "length": len(text.split()[0])}]
+        if photo is not None:
+            file_id, unique_id = photo
+            message["photo"] = [{"file_id": file_id, "file_unique_id": unique_id,
+                                 "width": 1280, "height": 720, "file_size": len(self.files[file_id])}]
+        if media_group_id is not None:
+            message["media_group_id"] = media_group_id
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def callback_update(self, user_id: int, data: str) -> dict:
+        user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._update_ids)),
+                "from": user,
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "text": "options",
+                },
+            },
+        }
+
+    async def post_update(self, update: dict) -> int:
+        """Deliver an update to the bot's webhook and return the HTTP status."""
+        headers = {SECRET_HEADER: self.secret_token} if self.secret_token else {}
+        async with self._session.post(self.webhook_url, json=update, headers=headers) as response:
+            return response.status
+
+
+async def main(args):
+    fake = FakeTelegram(args.webhook, args.secret)
+    await fake.start(port=args.port)
+    print(f"Fake Bot API on http://127.0.0.1:{args.port}/bot")
+    try:
+        if args.webhook:
+            status = await fake.post_update(fake.message_update(args.user, text="/start"))
+            print(f"/start -> HTTP {status}")
+            await asyncio.sleep(2)
+            for method, params in fake.calls:
+                print(method, {k: v for k, v in params.items() if isinstance(v, str)})
+        await asyncio.Event().wait()
+    finally:
+        await fake.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--webhook", help="bot webhook URL to post a /start update to")
+    parser.add_argument("--secret", help="secret token to send with updates")
+    parser.add_argument("--user", type=int, default=1000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Throughput of update processing with many users active at once.
+
+    python benchmarks/load_test_updates.py --users 100 --updates 10 --latency 0.05
+
+Every simulated user sends a burst of updates; each handler just awaits
+--latency seconds, the way the real handlers mostly wait on Telegram, the
+database or the render pool. The same load runs through PTB's sequential
+processing (one update at a time) and through PerUserUpdateProcessor, and
+the per-user order of handled updates is checked for both.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from telegram import Update
+from telegram.ext import SimpleUpdateProcessor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_telegram import FakeTelegram  # noqa: E402
+from update_processor import PerUserUpdateProcessor  # noqa: E402
+
+
+def make_updates(users: int, updates: int) -> list:
+    fake = FakeTelegram()
+    # Interleave users the way they arrive from Telegram
+    return [
+        Update.de_json(fake.message_update(1000 + user, text=f"message {n}"), None)
+        for n in range(updates)
+        for user in range(users)
+    ]
+
+
+async def run(processor, updates: list, latency: float) -> tuple:
+    handled = {}
+    active = {}
+    overlaps = 0
+
+    async def handle(update: Update):
+        nonlocal overlaps
+        user_id = update.effective_user.id
+        if active.get(user_id):
+            overlaps += 1
+        active[user_id] = True
+        await asyncio.sleep(latency)
+        handled.setdefault(user_id, []).append(update.update_id)
+        active[user_id] = False
+
+    await processor.initialize()
+    start = time.perf_counter()
+    await asyncio.gather(*[processor.process_update(update, handle(update)) for update in updates])
+    elapsed = time.perf_counter() - start
+    await processor.shutdown()
+
+    in_order = all(ids == sorted(ids) for ids in handled.values())
+    return elapsed, in_order, overlaps
+
+
+async def main(args):
+    updates = make_updates(args.users, args.updates)
+    runs = [
+        ("sequential", SimpleUpdateProcessor(1)),
+        (f"per-user ({args.concurrency})", PerUserUpdateProcessor(args.concurrency)),
+    ]
+    print(f"{len(updates)} updates from {args.users} users, {args.latency * 1000:.0f} ms per handler")
+    for name, processor in runs:
+        elapsed, in_order, overlaps = await run(processor, updates, args.latency)
+        print(f"{name:>18}: {elapsed:7.2f} s  {len(updates) / elapsed:8.1f} updates/s  "
+              f"per-user order {'kept' if in_order and not overlaps else 'BROKEN'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--updates", type=int, default=10, help="updates per user")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds each handler waits")
+    parser.add_argument("--concurrency", type=int, default=256)
+    asyncio.run(main(parser.parse_args()))
@@ -4,3 +4,136 @@ DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./watermark_bot.db")
 # Fix PostgreSQL URL format for Render
 if DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
+
+# Rendering executor (see render_pool.py)
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(os.cpu_count() or 1)))
+VIDEO_RENDER_WORKERS = int(os.getenv("VIDEO_RENDER_WORKERS", "2"))
+RENDER_EXECUTOR = os.getenv("RENDER_EXECUTOR", "process")  # process, thread
+RENDER_START_METHOD = os.getenv("RENDER_START_METHOD", "spawn")
+RENDER_QUEUE_SIZE = int(os.getenv("RENDER_QUEUE_SIZE", "32"))
+
+# Rendered watermark text cache, per render worker
+STAMP_CACHE_BYTES = int(os.getenv("STAMP_CACHE_BYTES", str(32 * 1024 * 1024)))
+
+# Fonts (see fonts.py)
+FONT_DIRS = [d for d in os.getenv(
+    "FONT_DIRS",
+    os.pathsep.join(["/usr/share/fonts", "/usr/local/share/fonts", "/System/Library/Fonts", "/Windows/Fonts"])
+).split(os.pathsep) if d]
+FONT_STYLE_PREFERENCE = ["bold", "regular", "book", "medium"]
+FONT_CACHE_SIZE = int(os.getenv("FONT_CACHE_SIZE", "64"))
+
+# Per-user watermark settings cache (see settings_cache.py)
+SETTINGS_CACHE_TTL = float(os.getenv("SETTINGS_CACHE_TTL", "300"))
+SETTINGS_CACHE_SIZE = int(os.getenv("SETTINGS_CACHE_SIZE", "10000"))
+
+# Async database pool (see database.py)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
+DB_QUERY_CACHE_SIZE = int(os.getenv("DB_QUERY_CACHE_SIZE", "1200"))
+
+# Media up to this size is downloaded, processed and uploaded in memory
+IN_MEMORY_MEDIA_LIMIT = int(os.getenv("IN_MEMORY_MEDIA_LIMIT", str(20 * 1024 * 1024)))
+
+# Sent-output cache: source file_unique_id + settings -> output file_id
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "5000"))
+RESULT_CACHE_MAX_AGE = float(os.getenv("RESULT_CACHE_MAX_AGE", str(24 * 60 * 60)))
+
+# Per-user source media kept for quick edits (see source_cache.py)
+SOURCE_CACHE_TTL = float(os.getenv("SOURCE_CACHE_TTL", "600"))
+SOURCE_CACHE_BYTES = int(os.getenv("SOURCE_CACHE_BYTES", str(256 * 1024 * 1024)))
+SOURCE_CACHE_DISK_BYTES = int(os.getenv("SOURCE_CACHE_DISK_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+# Video engine: auto (ffmpeg when installed), ffmpeg or opencv
+VIDEO_ENGINE = os.getenv("VIDEO_ENGINE", "auto")
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+FFMPEG_PRESET = os.getenv("FFMPEG_PRESET", "veryfast")
+FFMPEG_CRF = int(os.getenv("FFMPEG_CRF", "23"))
+FFMPEG_TIMEOUT = float(os.getenv("FFMPEG_TIMEOUT", "600"))  # seconds per ffmpeg/ffprobe run; 0 disables
+
+# Segment-parallel ffmpeg rendering; 1 disables it (see video_segments.py)
+FFPROBE_BINARY = os.getenv("FFPROBE_BINARY", "ffprobe")
+VIDEO_SEGMENTS = int(os.getenv("VIDEO_SEGMENTS", str(min(4, os.cpu_count() or 1))))
+VIDEO_SEGMENT_MIN_DURATION = float(os.getenv("VIDEO_SEGMENT_MIN_DURATION", "30"))
+
+# Frame buffers circulating through the OpenCV decode/blend/encode pipeline
+VIDEO_PIPELINE_RING_SIZE = int(os.getenv("VIDEO_PIPELINE_RING_SIZE", "8"))
+
+# Processing job scheduler (see scheduler.py)
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", "6"))
+MAX_JOBS_PER_USER = int(os.getenv("MAX_JOBS_PER_USER", "1"))
+# Lane caps add up to MAX_CONCURRENT_JOBS by default, so photos can't take
+# the slots videos need and the other way round
+VIDEO_LANE_SLOTS = int(os.getenv("VIDEO_LANE_SLOTS", "2"))
+IMAGE_LANE_SLOTS = int(os.getenv("IMAGE_LANE_SLOTS", str(max(1, MAX_CONCURRENT_JOBS - VIDEO_LANE_SLOTS))))
+
+# Subscription plans: queue priority (lower runs first), share of a lane's
+# slots a plan may occupy while better plans' jobs wait, media limits and
+# files per UTC day (None = no limit). Everyone without a subscription is on
+# the free plan, so its limits are off unless configured (0 = no limit).
+DEFAULT_PLAN = "free"
+FREE_PLAN_SHARE = float(os.getenv("FREE_PLAN_SHARE", "1.0"))
+FREE_MAX_VIDEO_DURATION = int(os.getenv("FREE_MAX_VIDEO_DURATION", "0")) or None  # seconds
+FREE_MAX_VIDEO_HEIGHT = int(os.getenv("FREE_MAX_VIDEO_HEIGHT", "0")) or None  # short side in pixels
+FREE_DAILY_LIMIT = int(os.getenv("FREE_DAILY_LIMIT", "0")) or None
+PLAN_POLICIES = {
+    "free": {"priority": 3, "share": FREE_PLAN_SHARE, "max_video_duration": FREE_MAX_VIDEO_DURATION,
+             "max_video_height": FREE_MAX_VIDEO_HEIGHT, "daily_limit": FREE_DAILY_LIMIT},
+    "basic": {"priority": 2, "share": 0.75, "max_video_duration": 300, "max_video_height": 1080,
+              "daily_limit": 500},
+    "premium": {"priority": 1, "share": 1.0, "max_video_duration": 1800, "max_video_height": 2160,
+                "daily_limit": None},
+    "unlimited": {"priority": 0, "share": 1.0, "max_video_duration": None, "max_video_height": None,
+                  "daily_limit": None},
+}
+PLAN_CACHE_TTL = float(os.getenv("PLAN_CACHE_TTL", "300"))
+
+# Usage accounting (see usage.py)
+USAGE_BATCH_SIZE = int(os.getenv("USAGE_BATCH_SIZE", "100"))
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "10"))
+USAGE_MAX_BACKLOG = int(os.getenv("USAGE_MAX_BACKLOG", "10000"))
+
+# Seconds to wait for more photos of an album before showing the options
+ALBUM_COLLECT_DELAY = float(os.getenv("ALBUM_COLLECT_DELAY", "1.0"))
+
+# Update delivery: "polling", or "webhook" (see webhook_server.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # public base URL, e.g. https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8080")))
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "")  # required when BOT_MODE=webhook
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+WEBHOOK_MAX_BODY_SIZE = int(os.getenv("WEBHOOK_MAX_BODY_SIZE", str(1024 * 1024)))
+# Updates handled at once; each user's updates still run in order
+# (see update_processor.py)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "256"))
+# Bot API endpoints, overridable to point at benchmarks/fake_telegram.py
+TELEGRAM_BASE_URL = os.getenv("TELEGRAM_BASE_URL", "https://api.telegram.org/bot")
+TELEGRAM_BASE_FILE_URL = os.getenv("TELEGRAM_BASE_FILE_URL", "https://api.telegram.org/file/bot")
+
+# Metrics (see metrics.py): set METRICS_PORT to serve /metrics and
+# /metrics.json on their own listener, local only unless METRICS_HOST says
+# otherwise; they are never exposed on the public webhook port
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Logging (see logging_setup.py)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text, json
+# Share of per-render debug details kept when LOG_LEVEL=DEBUG
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.01"))
+
+# Profiling (see profiling.py); /profile is limited to these Telegram user ids
+ADMIN_USER_IDS = {int(i) for i in os.getenv("ADMIN_USER_IDS", "").split(",") if i.strip()}
+# Profile every Nth watermark request to PROFILE_DIR; 0 disables
+PROFILE_SAMPLE_EVERY = int(os.getenv("PROFILE_SAMPLE_EVERY", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "40"))
+
+# Photos are rendered at most this many pixels on the longer side, the
+# largest size Telegram delivers for photos; "Full Resolution" skips it
+PHOTO_MAX_SIDE = int(os.getenv("PHOTO_MAX_SIDE", "2560"))
@@ -1,4 +1,49 @@
+from contextlib import asynccontextmanager
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 # Database setup
 DATABASE_URL = config.DATABASE_URL
 
 engine = create_engine(DATABASE_URL, echo=False)
+
+
+# Async engine used by the bot handlers and MediaProcessor
+def to_async_url(url: str) -> str:
+    """Swap the sync driver in a database URL for its asyncio driver."""
+    if url.startswith("postgresql://") or url.startswith("postgresql+psycopg2://"):
+        url = "postgresql+asyncpg://" + url.split("://", 1)[1]
+        separator = "&" if "?" in url else "?"
+        url += f"{separator}prepared_statement_cache_size={config.DB_STATEMENT_CACHE_SIZE}"
+    elif url.startswith("sqlite://"):
+        url = "sqlite+aiosqlite://" + url.split("://", 1)[1]
+    return url
+
+
+ASYNC_DATABASE_URL = to_async_url(DATABASE_URL)
+
+_async_engine_options = {
+    "echo": False,
+    "pool_pre_ping": True,
+    "query_cache_size": config.DB_QUERY_CACHE_SIZE,
+}
+if not ASYNC_DATABASE_URL.startswith("sqlite"):
+    _async_engine_options.update(
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW,
+        pool_timeout=config.DB_POOL_TIMEOUT,
+        pool_recycle=config.DB_POOL_RECYCLE,
+    )
+
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_async_engine_options)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
+
+@asynccontextmanager
+async def get_async_session():
+    """Yield an AsyncSession from the pool, closing it afterwards."""
+    async with AsyncSessionLocal() as session:
+        yield session
+
+
+async def dispose_async_engine():
+    """Close pooled connections on shutdown."""
+    await async_engine.dispose()
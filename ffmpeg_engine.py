@@ -0,0 +1,112 @@
+import logging
+import os
+import shutil
+import subprocess
+import uuid
+import config
+
+logger = logging.getLogger(__name__)
+
+MARGIN = 20  # Same edge margin as MediaProcessor.calculate_position
+
+# stderr fragments (lowercased) meaning the copied audio stream doesn't fit
+# the output; stream 0:1 is the audio since the video is mapped first
+AUDIO_COPY_ERRORS = (
+    "codec not currently supported in container",
+    "could not find tag for codec",
+    "incompatible with output codec",
+    "output stream 0:1",
+)
+
+
+class FFmpegError(RuntimeError):
+    """ffmpeg exited with an error."""
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which(config.FFMPEG_BINARY) is not None
+
+
+def overlay_position(position: str, offset: tuple) -> tuple:
+    """ffmpeg overlay x/y expressions matching MediaProcessor.calculate_position.
+
+    W/H are the video size and w/h the stamp size; offset is the stamp's
+    textbbox origin, applied the same way as for photos.
+    """
+    positions = {
+        "top_left": (f"{MARGIN}", f"{MARGIN}"),
+        "top_right": (f"W-w-{MARGIN}", f"{MARGIN}"),
+        "bottom_left": (f"{MARGIN}", f"H-h-{MARGIN}"),
+        "bottom_right": (f"W-w-{MARGIN}", f"H-h-{MARGIN}"),
+        "center": ("(W-w)/2", "(H-h)/2"),
+    }
+    x, y = positions.get(position, positions["bottom_right"])
+    return f"{x}{offset[0]:+d}", f"{y}{offset[1]:+d}"
+
+
+def build_overlay_command(input_path: str, stamp_path: str, output_path: str,
+                          position: str, offset: tuple, audio_codec: str = "copy",
+                          threads: int = 0) -> list:
+    """ffmpeg command that overlays a PNG stamp and encodes H.264.
+
+    yuv420p needs even dimensions, so an odd width or height loses its last
+    pixel column or row after the overlay. The first audio stream, if any,
+    is passed through with audio_codec.
+    """
+    x, y = overlay_position(position, offset)
+    return [
+        config.FFMPEG_BINARY, "-hide_banner", "-loglevel", "error", "-y",
+        "-i", input_path,
+        "-i", stamp_path,
+        "-filter_complex", f"[0:v][1:v]overlay=x={x}:y={y}:format=auto,"
+                            "scale=trunc(iw/2)*2:trunc(ih/2)*2,format=yuv420p[v]",
+        "-map", "[v]", "-map", "0:a:0?",
+        "-c:v", "libx264", "-preset", config.FFMPEG_PRESET, "-crf", str(config.FFMPEG_CRF),
+        "-threads", str(threads),
+        "-c:a", audio_codec,
+        "-movflags", "+faststart",
+        output_path,
+    ]
+
+
+def is_audio_copy_error(error: Exception) -> bool:
+    message = str(error).lower()
+    return any(fragment in message for fragment in AUDIO_COPY_ERRORS)
+
+
+def run_ffmpeg(command: list, timeout: float = None):
+    """Run ffmpeg; FFmpegError if it fails or runs longer than timeout seconds."""
+    timeout = timeout or config.FFMPEG_TIMEOUT or None
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        # subprocess.run has already killed it
+        raise FFmpegError(f"ffmpeg timed out after {timeout:g}s")
+    if result.returncode != 0:
+        raise FFmpegError(result.stderr.strip() or f"ffmpeg exited with {result.returncode}")
+
+
+def render_video_ffmpeg(input_path: str, output_path: str, stamp, position: str,
+                        threads: int = 0, audio_codec: str = None) -> str:
+    """Overlay a TextStamp on a video with ffmpeg, keeping the audio track.
+
+    By default the audio is copied as-is; if ffmpeg reports that the
+    container can't hold that codec it is re-encoded to AAC instead. Other
+    failures are raised without a retry. An explicit audio_codec is used
+    without the fallback.
+    """
+    stamp_path = os.path.join(config.TEMP_DIR, f"stamp_{uuid.uuid4().hex}.png")
+    stamp.image.save(stamp_path)
+    try:
+        try:
+            run_ffmpeg(build_overlay_command(input_path, stamp_path, output_path, position, stamp.offset,
+                                             audio_codec=audio_codec or "copy", threads=threads))
+        except FFmpegError as e:
+            if audio_codec is not None or not is_audio_copy_error(e):
+                raise
+            logger.warning(f"Audio copy failed, re-encoding audio: {e}")
+            run_ffmpeg(build_overlay_command(input_path, stamp_path, output_path,
+                                             position, stamp.offset, audio_codec="aac", threads=threads))
+    finally:
+        os.remove(stamp_path)
+    return output_path
@@ -0,0 +1,143 @@
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from PIL import ImageFont
+import config
+
+logger = logging.getLogger(__name__)
+
+FONT_EXTENSIONS = ('.ttf', '.otf', '.ttc')
+
+# Style suffixes stripped from file names to get the family name
+STYLE_WORDS = ('bolditalic', 'boldoblique', 'bold', 'italic', 'oblique',
+               'regular', 'book', 'medium', 'light')
+
+# Families that may be asked for but are rarely installed, mapped to
+# metric-compatible or look-alike substitutes
+FAMILY_ALIASES = {
+    'arial': ['arial', 'liberationsans', 'dejavusans'],
+    'helvetica': ['helvetica', 'liberationsans', 'dejavusans'],
+    'timesnewroman': ['timesnewroman', 'times', 'liberationserif', 'dejavuserif'],
+    'times': ['times', 'timesnewroman', 'liberationserif', 'dejavuserif'],
+    'couriernew': ['couriernew', 'courier', 'liberationmono', 'dejavusansmono'],
+    'courier': ['courier', 'couriernew', 'liberationmono', 'dejavusansmono'],
+}
+
+# Used when a family isn't installed at all; same order the bot always used
+DEFAULT_FONT_PATHS = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+    "/System/Library/Fonts/Arial.ttf",  # macOS
+    "/Windows/Fonts/arial.ttf",  # Windows
+]
+
+
+def normalize_family(name: str) -> str:
+    """Lower-case a family name and drop spaces, dashes and underscores."""
+    return re.sub(r'[\s_\-]+', '', name.lower())
+
+
+def split_font_name(file_name: str) -> tuple:
+    """Split a font file name into (family, style), e.g. DejaVuSans-Bold -> (dejavusans, bold)."""
+    stem = normalize_family(os.path.splitext(file_name)[0])
+    for style in STYLE_WORDS:
+        if stem.endswith(style) and len(stem) > len(style):
+            return stem[:-len(style)], style
+    return stem, 'regular'
+
+
+class FontRegistry:
+    """Process-wide index of installed fonts and cache of loaded FreeType fonts.
+
+    Font directories are scanned once, on first use, and each family is
+    resolved to a file once. Loaded fonts are kept per (file, size) in an
+    LRU of at most FONT_CACHE_SIZE entries.
+    """
+
+    def __init__(self, font_dirs: list = None, cache_size: int = None):
+        self.font_dirs = font_dirs if font_dirs is not None else config.FONT_DIRS
+        self.cache_size = cache_size or config.FONT_CACHE_SIZE
+        self._families = None
+        self._resolved = {}
+        self._fonts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def discover(self) -> dict:
+        """Scan font directories and index font files by family and style."""
+        with self._lock:
+            if self._families is not None:
+                return self._families
+            families = {}
+            for font_dir in self.font_dirs:
+                for root, _, files in os.walk(font_dir):
+                    for file_name in files:
+                        if not file_name.lower().endswith(FONT_EXTENSIONS):
+                            continue
+                        family, style = split_font_name(file_name)
+                        families.setdefault(family, {}).setdefault(style, os.path.join(root, file_name))
+            self._families = families
+            logger.info(f"Discovered {len(families)} font families")
+            return families
+
+    def families(self) -> list:
+        return sorted(self.discover())
+
+    def resolve(self, font_family: str) -> str:
+        """Return the font file to use for a family, or None if nothing fits."""
+        # Keyed by the name as given, so hits skip normalizing it. Fallbacks
+        # (a default path or None) are cached too; they would otherwise stat
+        # every DEFAULT_FONT_PATHS entry on each call
+        try:
+            return self._resolved[font_family]
+        except KeyError:
+            pass
+        font_path = self._find(normalize_family(font_family or ''))
+        with self._lock:
+            self._resolved[font_family] = font_path
+        return font_path
+
+    def _find(self, family: str) -> str:
+        families = self.discover()
+        for candidate in FAMILY_ALIASES.get(family, [family]):
+            styles = families.get(candidate)
+            if styles:
+                for style in config.FONT_STYLE_PREFERENCE:
+                    if style in styles:
+                        return styles[style]
+                return next(iter(styles.values()))
+        for font_path in DEFAULT_FONT_PATHS:
+            if os.path.exists(font_path):
+                return font_path
+        return None
+
+    def get_font(self, font_family: str, font_size: int) -> ImageFont.FreeTypeFont:
+        """Return a loaded font for (family, size), loading it on first use."""
+        font_path = self.resolve(font_family)
+        key = (font_path, font_size)
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is not None:
+                self._fonts.move_to_end(key)
+                return font
+
+        if font_path is None:
+            font = ImageFont.load_default(font_size)
+        else:
+            try:
+                font = ImageFont.truetype(font_path, font_size)
+            except OSError as e:
+                logger.warning(f"Font loading error for {font_path}: {e}")
+                font = ImageFont.load_default(font_size)
+
+        with self._lock:
+            self._fonts[key] = font
+            while len(self._fonts) > self.cache_size:
+                self._fonts.popitem(last=False)
+        return font
+
+
+font_registry = FontRegistry()
@@ -0,0 +1,115 @@
+import atexit
+import contextvars
+import json
+import logging
+import queue
+import random
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+import config
+
+correlation_id = contextvars.ContextVar("correlation_id", default="-")
+
+# extra= for debug records that are only kept at LOG_DEBUG_SAMPLE_RATE; pass
+# their arguments %-style so dropped records are never formatted
+SAMPLED = {'sample': True}
+
+_listener = None
+
+
+@contextmanager
+def log_context(user_id=None, unique_id: str = None):
+    """Tag log records in this block with user id and file_unique_id."""
+    parts = [str(user_id) if user_id is not None else correlation_id.get().split(":")[0]]
+    if unique_id:
+        parts.append(unique_id)
+    token = correlation_id.set(":".join(parts))
+    try:
+        yield
+    finally:
+        correlation_id.reset(token)
+
+
+def run_with_correlation(cid: str, fn, *args):
+    """Call fn with a correlation id from another thread or process."""
+    correlation_id.set(cid)
+    return fn(*args)
+
+
+class CorrelationFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = correlation_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Let through only a fraction of debug records logged with extra={'sample': True}."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno <= logging.DEBUG and getattr(record, "sample", False):
+            return random.random() < self.rate
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'correlation_id': getattr(record, "correlation_id", "-"),
+            'process': record.processName,
+            'thread': record.threadName,
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def setup_logging(level: str = None, fmt: str = None, sample_rate: float = None) -> QueueListener:
+    """Route all logging through a queue so formatting and I/O happen on a listener thread.
+
+    Call once per process (the bot and each render worker). Records get the
+    current correlation id when they are logged; sampled debug records are
+    dropped before they are queued.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    level = level or config.LOG_LEVEL
+    fmt = fmt or config.LOG_FORMAT
+    sample_rate = config.LOG_DEBUG_SAMPLE_RATE if sample_rate is None else sample_rate
+
+    output = logging.StreamHandler(sys.stdout)
+    if fmt == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - [%(correlation_id)s] %(message)s'
+        ))
+
+    log_queue = queue.SimpleQueue()
+    handler = QueueHandler(log_queue)
+    handler.addFilter(CorrelationFilter())
+    handler.addFilter(SamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    # Each request logs through httpx; keep only its warnings
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
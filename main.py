@@ -1,37 +1,57 @@
 import os
+import asyncio
 import logging
 from telegram.ext import Application
 from simple_bot import SimpleBotHandler
-from database import init_db
+from database import engine, init_db
+from models import create_missing_indexes
+from webhook_server import run_webhook
+from update_processor import PerUserUpdateProcessor
+from logging_setup import setup_logging
+import config
 
-# Configure logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+logger = logging.getLogger(__name__)
 
 def main():
     """Start the bot."""
+    # Log through a background listener (JSON with LOG_FORMAT=json)
+    setup_logging()
+    
     # Initialize database
     init_db()
+    create_missing_indexes(engine)
     
     # Get bot token from environment
     bot_token = os.getenv("TELEGRAM_BOT_TOKEN", "7862951291:AAFLCXBgekpq_do1yl63TIFvgtCADjCr66k")
     if not bot_token:
         raise ValueError("TELEGRAM_BOT_TOKEN environment variable is required")
     
-    # Create application
-    application = Application.builder().token(bot_token).build()
-    
     # Initialize bot handler
     bot_handler = SimpleBotHandler()
     
+    # Create application
+    application = (
+        Application.builder()
+        .token(bot_token)
+        .base_url(config.TELEGRAM_BASE_URL)
+        .base_file_url(config.TELEGRAM_BASE_FILE_URL)
+        .concurrent_updates(PerUserUpdateProcessor(config.CONCURRENT_UPDATES))
+        .post_init(bot_handler.post_init)
+        .post_shutdown(bot_handler.post_shutdown)
+        .build()
+    )
+    
     # Add handlers
     bot_handler.setup_handlers(application)
     
     # Run the bot
-    print("Starting Telegram Watermark Bot...")
-    application.run_polling(allowed_updates=["message", "callback_query"])
+    allowed_updates = ["message", "callback_query"]
+    if config.BOT_MODE == "webhook":
+        logger.info("Starting Telegram Watermark Bot (webhook)...")
+        asyncio.run(run_webhook(application, allowed_updates=allowed_updates))
+    else:
+        logger.info("Starting Telegram Watermark Bot...")
+        application.run_polling(allowed_updates=allowed_updates)
 
 if __name__ == '__main__':
     main()
@@ -1,90 +1,224 @@
+import io
 import os
 import cv2
 import asyncio
-from PIL import Image, ImageDraw, ImageFont
-from database import get_db_session
-from models import User, WatermarkSettings
+import logging
+from PIL import Image, ImageFont
+from settings_cache import settings_cache
+from ffmpeg_engine import ffmpeg_available, render_video_ffmpeg
+from fonts import font_registry
+from logging_setup import SAMPLED
+from metrics import record_timings, timed
+from video_pipeline import FramePipeline
+from video_segments import render_video_segmented
+from watermark_stamp import StampCache, TextStamp, VideoStamp
 import config
 
+logger = logging.getLogger(__name__)
+
 class MediaProcessor:
-    def __init__(self):
+    def __init__(self, render_pool=None):
+        # Rendering runs in render_pool when given, otherwise in the
+        # default thread executor; either way the event loop stays free.
+        self.render_pool = render_pool
+        self.stamp_cache = StampCache()
         self.ensure_temp_dir()
     
     def ensure_temp_dir(self):
         """Ensure temp directory exists."""
         os.makedirs(config.TEMP_DIR, exist_ok=True)
     
-    async def process_image(self, file_path: str, user_id: str) -> str:
+    def warm_up(self):
+        """Load resources a render worker needs before its first job."""
+        font_registry.discover()
+        self.load_font(config.DEFAULT_WATERMARK_SETTINGS['font_family'],
+                       config.DEFAULT_WATERMARK_SETTINGS['font_size'])
+    
+    async def process_image(self, file_path: str, user_id: str, settings: dict = None,
+                            full_resolution: bool = False) -> str:
         """Process image and add watermark."""
-        # Get user watermark settings
-        settings = self.get_user_settings(user_id)
+        # Get user watermark settings unless the caller already has them
+        if settings is None:
+            settings = await self.get_user_settings(user_id)
         
-        print(f"Processing image for user {user_id}")
-        print(f"Settings - Text: {settings['text']}, Font: {settings['font_size']}, Color: {settings['color']}, Opacity: {settings['opacity']}, Position: {settings['position']}")
+        max_side = None if full_resolution else config.PHOTO_MAX_SIDE
+        logger.info(f"Processing image for user {user_id}")
+        if self.render_pool is not None:
+            return await self.render_pool.render_image(file_path, settings, max_side)
+        return await self.render_in_thread(self.render_image, file_path, settings, max_side)
+    
+    async def process_video(self, file_path: str, user_id: str, settings: dict = None) -> str:
+        """Process video and add watermark."""
+        # Get user watermark settings unless the caller already has them
+        if settings is None:
+            settings = await self.get_user_settings(user_id)
         
-        # Open image
-        image = Image.open(file_path)
+        logger.info(f"Processing video for user {user_id}")
+        if self.render_pool is not None:
+            return await self.render_pool.render_video(file_path, settings)
+        return await self.render_in_thread(self.render_video, file_path, settings)
+    
+    async def process_image_bytes(self, data: bytes, user_id: str, settings: dict = None,
+                                  full_resolution: bool = False) -> bytes:
+        """Process an encoded image held in memory and return the JPEG bytes."""
+        if settings is None:
+            settings = await self.get_user_settings(user_id)
         
-        # Convert to RGBA if not already
-        if image.mode != 'RGBA':
-            image = image.convert('RGBA')
+        max_side = None if full_resolution else config.PHOTO_MAX_SIDE
+        logger.info(f"Processing image for user {user_id}")
+        if self.render_pool is not None:
+            return await self.render_pool.render_image_bytes(data, settings, max_side)
+        return await self.render_in_thread(self.render_image_bytes, data, settings, max_side)
+    
+    async def render_in_thread(self, render, *args):
+        """Run a blocking render method in the default executor and record its timings."""
+        timings = {}
+        result = await asyncio.to_thread(render, *args, timings)
+        record_timings(timings)
+        return result
+    
+    def render_image(self, file_path: str, settings: dict, max_side: int = None,
+                     timings: dict = None) -> str:
+        """Add the watermark to an image file. Blocking; runs in a render worker."""
+        timings = {} if timings is None else timings
+        with timed(timings, 'decode'):
+            image, settings = self.open_image(file_path, settings, max_side)
+        with timed(timings, 'render'):
+            watermarked = self.watermark_image(image, settings)
+        
+        # Save processed image
+        output_path = f"{config.TEMP_DIR}/watermarked_{os.path.basename(file_path)}"
+        with timed(timings, 'encode'):
+            watermarked.save(output_path, quality=95)
         
-        # Create transparent overlay
-        overlay = Image.new('RGBA', image.size, (0, 0, 0, 0))
-        draw = ImageDraw.Draw(overlay)
+        return output_path
+    
+    def render_image_bytes(self, data: bytes, settings: dict, max_side: int = None,
+                           timings: dict = None) -> bytes:
+        """Add the watermark to an encoded image in memory. Blocking; runs in a render worker."""
+        timings = {} if timings is None else timings
+        with timed(timings, 'decode'):
+            image, settings = self.open_image(io.BytesIO(data), settings, max_side)
+        with timed(timings, 'render'):
+            watermarked = self.watermark_image(image, settings)
         
-        # Load font
-        font = self.load_font(settings['font_family'], settings['font_size'])
+        output = io.BytesIO()
+        with timed(timings, 'encode'):
+            watermarked.save(output, format='JPEG', quality=95)
+        return output.getvalue()
+    
+    def open_image(self, source, settings: dict, max_side: int = None) -> tuple:
+        """Decode an image, at most max_side pixels on its longer side.
         
-        # Get text dimensions
-        bbox = draw.textbbox((0, 0), settings['text'], font=font)
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
+        Oversized JPEGs are decoded directly at a reduced scale with draft()
+        (the decoder skips DCT detail instead of producing every pixel), then
+        shrunk with reduce() and a final resize. The font size is scaled by
+        the same factor so the watermark covers the same share of the image
+        as it would at full resolution. Returns (image, settings).
+        """
+        image = Image.open(source)
+        width, height = image.size
+        if not max_side or max(width, height) <= max_side:
+            image.load()
+            return image, settings
         
-        print(f"Text dimensions: {text_width}x{text_height}")
+        scale = max_side / max(width, height)
+        target = (max(1, round(width * scale)), max(1, round(height * scale)))
+        if image.format == 'JPEG':
+            image.draft('RGB', target)
+        # reduce() and resize() don't handle palette, 1-bit or 16-bit modes
+        image = self.to_rgb(image)
+        factor = min(image.size[0] // target[0], image.size[1] // target[1])
+        if factor >= 2:
+            image = image.reduce(factor)
+        if image.size != target:
+            image = image.resize(target, Image.LANCZOS)
+        image.load()
+        
+        settings = dict(settings, font_size=max(1, round(settings['font_size'] * scale)))
+        logger.debug("Decoded %sx%s image at %sx%s", width, height, target[0], target[1], extra=SAMPLED)
+        return image, settings
+    
+    @staticmethod
+    def to_rgb(image: Image.Image) -> Image.Image:
+        """Convert a decoded image of any mode to RGB; alpha is dropped."""
+        if image.mode == 'RGB':
+            return image
+        if image.mode not in ('RGBA', 'L', 'LA', 'CMYK', 'YCbCr'):
+            # Palette, 1-bit and 16-bit images go through RGBA, which
+            # converts from every mode
+            image = image.convert('RGBA')
+        return image.convert('RGB')
+    
+    def watermark_image(self, image: Image.Image, settings: dict) -> Image.Image:
+        """Draw the watermark on a decoded image and return it as RGB.
+        
+        Only the stamp's bounding box is blended: the text colour is pasted
+        through its alpha mask, which equals alpha-compositing the stamp over
+        the opaque image. An RGB image is modified in place.
+        """
+        image = self.to_rgb(image)
+        
+        # Rendered text, reused across images with the same settings
+        stamp = self.get_text_stamp(settings)
         
         # Calculate position
         x, y = self.calculate_position(
             image.size[0], image.size[1], 
-            int(text_width), int(text_height), 
+            stamp.width, stamp.height, 
             settings['position']
         )
         
-        print(f"Text position: ({x}, {y})")
-        
-        # Parse color
-        color = self.parse_color(settings['color'], settings['opacity'])
-        print(f"Text color: {color}")
-        
-        # Draw simple text without effects
-        draw.text((x, y), settings['text'], font=font, fill=color)
-        
-        # Composite the overlay onto the original image
-        watermarked = Image.alpha_composite(image, overlay)
-        
-        # Convert back to RGB if needed
-        if watermarked.mode == 'RGBA':
-            watermarked = watermarked.convert('RGB')
+        logger.debug(
+            "Settings - Text: %s, Font: %s, Color: %s, Opacity: %s, Position: %s; "
+            "image %sx%s, text %sx%s at (%s, %s)",
+            settings['text'], settings['font_size'], settings['color'], settings['opacity'], settings['position'],
+            image.size[0], image.size[1], stamp.width, stamp.height, x, y,
+            extra=SAMPLED
+        )
         
-        # Save processed image
-        output_path = f"{config.TEMP_DIR}/watermarked_{os.path.basename(file_path)}"
-        watermarked.save(output_path, quality=95)
+        # Blend the text into its box; paste clips at the image edges
+        image.paste(stamp.rgb, (x + stamp.offset[0], y + stamp.offset[1]), mask=stamp.mask)
         
-        return output_path
+        return image
     
-    async def process_video(self, file_path: str, user_id: str) -> str:
-        """Process video and add watermark."""
-        # Get user watermark settings
-        settings = self.get_user_settings(user_id)
-        
-        print(f"Processing video for user {user_id}")
-        print(f"Settings - Text: {settings['text']}, Font: {settings['font_size']}, Color: {settings['color']}, Opacity: {settings['opacity']}, Position: {settings['position']}")
+    def render_video(self, file_path: str, settings: dict, timings: dict = None) -> str:
+        """Add the watermark to a video. Blocking; runs in a render worker."""
+        timings = {} if timings is None else timings
+        logger.debug(
+            "Settings - Text: %s, Font: %s, Color: %s, Opacity: %s, Position: %s",
+            settings['text'], settings['font_size'], settings['color'], settings['opacity'], settings['position'],
+            extra=SAMPLED
+        )
         
+        if self.video_engine() == "ffmpeg":
+            # ffmpeg decodes, blends and encodes in one process
+            with timed(timings, 'video_ffmpeg'):
+                return self.render_video_ffmpeg(file_path, settings)
+        return self.render_video_opencv(file_path, settings, timings)
+    
+    def video_engine(self) -> str:
+        """Pick the video engine from VIDEO_ENGINE (auto, ffmpeg or opencv)."""
+        if config.VIDEO_ENGINE == "auto":
+            return "ffmpeg" if ffmpeg_available() else "opencv"
+        return config.VIDEO_ENGINE
+    
+    def render_video_ffmpeg(self, file_path: str, settings: dict) -> str:
+        """Overlay the PIL text stamp with ffmpeg: H.264 output, audio kept."""
+        output_path = f"{config.TEMP_DIR}/watermarked_{os.path.splitext(os.path.basename(file_path))[0]}.mp4"
+        stamp = self.get_text_stamp(settings)
+        if config.VIDEO_SEGMENTS > 1:
+            # Long videos are split and rendered on several cores
+            return render_video_segmented(file_path, output_path, stamp, settings['position'])
+        return render_video_ffmpeg(file_path, output_path, stamp, settings['position'])
+    
+    def render_video_opencv(self, file_path: str, settings: dict, timings: dict = None) -> str:
+        """Frame-by-frame OpenCV render (mp4v, no audio)."""
         # Open video
         cap = cv2.VideoCapture(file_path)
         
-        # Get video properties
-        fps = int(cap.get(cv2.CAP_PROP_FPS))
+        # Get video properties; keep fractional rates such as 29.97
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
         width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
         
@@ -104,87 +238,51 @@ class MediaProcessor:
         text_size = cv2.getTextSize(settings['text'], font, font_scale, 2)[0]
         x, y = self.calculate_position(width, height, text_size[0], text_size[1], settings['position'])
         
-        # Process each frame
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            # Create overlay for transparency
-            overlay = frame.copy()
-            
-            # Add text to overlay
-            cv2.putText(overlay, settings['text'], (x, y), font, font_scale, color, 2, cv2.LINE_AA)
-            
-            # Blend overlay with original frame for transparency effect
-            alpha = settings['opacity'] / 255.0
-            frame = cv2.addWeighted(overlay, alpha, frame, 1 - alpha, 0)
-            
-            # Write frame
-            out.write(frame)
-        
-        # Release everything
-        cap.release()
-        out.release()
+        # Render the text once; each frame only blends its bounding box
+        stamp = VideoStamp(settings['text'], (x, y), font, font_scale, color, 2,
+                           settings['opacity'], (width, height))
         
-        return output_path
-    
-    def get_user_settings(self, user_id: str) -> dict:
-        """Get user watermark settings from database."""
-        db = get_db_session()
+        # Decode, blend the watermark in place, and encode on overlapping threads
         try:
-            user = db.query(User).filter(User.telegram_id == user_id).first()
-            if not user:
-                # Return default settings if user not found
-                return config.DEFAULT_WATERMARK_SETTINGS
-            
-            settings = db.query(WatermarkSettings).filter(WatermarkSettings.user_id == user.id).first()
-            if not settings:
-                # Create default settings if not exist
-                settings = WatermarkSettings(user_id=user.id, **config.DEFAULT_WATERMARK_SETTINGS)
-                db.add(settings)
-                db.commit()
-                return config.DEFAULT_WATERMARK_SETTINGS
-            
-            # Extract actual values from SQLAlchemy model
-            return {
-                'text': settings.text,
-                'font_size': settings.font_size,
-                'opacity': settings.opacity,
-                'position': settings.position,
-                'color': settings.color,
-                'font_family': settings.font_family
-            }
+            pipeline_timings = FramePipeline(cap, out, stamp.apply, (width, height)).run()
         finally:
-            db.close()
+            # Release everything
+            cap.release()
+            out.release()
+        
+        logger.info(f"Video frames: {pipeline_timings['frames']}, decode {pipeline_timings['decode']:.2f}s, "
+                    f"blend {pipeline_timings['blend']:.2f}s, encode {pipeline_timings['encode']:.2f}s")
+        if timings is not None:
+            # Busy time per stage; the stages overlap, so they add up to more than the wall time
+            timings.update(video_decode=pipeline_timings['decode'], video_blend=pipeline_timings['blend'],
+                           video_encode=pipeline_timings['encode'])
+        
+        return output_path
+    
+    def get_text_stamp(self, settings: dict) -> TextStamp:
+        """Get the rendered watermark text for these settings from the cache."""
+        key = (settings['text'], settings['font_family'], settings['font_size'],
+               settings['color'], settings['opacity'])
+        
+        def build():
+            font = self.load_font(settings['font_family'], settings['font_size'])
+            color = self.parse_color(settings['color'], settings['opacity'])
+            logger.debug("Text color: %s", color, extra=SAMPLED)
+            return TextStamp(settings['text'], font, color)
+        
+        return self.stamp_cache.get(key, build)
+    
+    async def get_user_settings(self, user_id: str) -> dict:
+        """Get user watermark settings from the settings cache."""
+        settings = await settings_cache.get_settings(user_id)
+        if not settings:
+            # Return default settings if user not found
+            return dict(config.DEFAULT_WATERMARK_SETTINGS)
+        return settings
     
     def load_font(self, font_family: str, font_size: int) -> ImageFont.FreeTypeFont:
-        """Load font for PIL."""
-        try:
-            # Try multiple font paths for better compatibility
-            font_paths = [
-                f"/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
-                f"/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-                f"/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
-                f"/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
-                f"/System/Library/Fonts/Arial.ttf",  # macOS
-                f"/Windows/Fonts/arial.ttf",  # Windows
-            ]
-            
-            for font_path in font_paths:
-                if os.path.exists(font_path):
-                    print(f"Loading font: {font_path} with size {font_size}")
-                    return ImageFont.truetype(font_path, font_size)
-            
-            # Create default with proper size support
-            print(f"Using default font with size {font_size}")
-            try:
-                return ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", font_size)
-            except:
-                return ImageFont.load_default()
-        except Exception as e:
-            print(f"Font loading error: {e}")
-            return ImageFont.load_default()
+        """Load font for PIL from the process-wide font registry."""
+        return font_registry.get_font(font_family, font_size)
     
     def calculate_position(self, image_width: int, image_height: int, 
                           text_width: int, text_height: int, position: str) -> tuple:
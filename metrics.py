@@ -0,0 +1,207 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+import config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: tuple, extra: dict = None) -> str:
+    pairs = list(key) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, lock: threading.Lock):
+        self.name = name
+        self.help = help
+        self._lock = lock
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> list:
+        return [(self.name, key, value) for key, value in self._values.items()]
+
+    def to_dict(self) -> dict:
+        return {_format_labels(key) or "value": value for key, value in self._values.items()}
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, lock: threading.Lock, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._lock = lock
+        self._values = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def samples(self) -> list:
+        samples = []
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", key, cumulative, {'le': bound}))
+            samples.append((f"{self.name}_bucket", key, count, {'le': "+Inf"}))
+            samples.append((f"{self.name}_sum", key, total))
+            samples.append((f"{self.name}_count", key, count))
+        return samples
+
+    def to_dict(self) -> dict:
+        return {
+            _format_labels(key) or "value": {
+                'count': count,
+                'sum': total,
+                'mean': total / count if count else 0.0,
+            }
+            for key, (counts, total, count) in self._values.items()
+        }
+
+
+class MetricsRegistry:
+    """In-process counters and histograms, exported in Prometheus text format.
+
+    Values that other components already track (cache stats, queue depth)
+    are not duplicated here; register_collector() adds a callable that
+    reports them as gauges at scrape time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._register(Counter(name, help, self._lock))
+
+    def histogram(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, self._lock, buckets))
+
+    def register_collector(self, collector):
+        """Add collector() -> [(name, labels, value), ...], reported as gauges."""
+        self._collectors.append(collector)
+
+    def render_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for metric in self._metrics.values():
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.type}")
+                for sample in metric.samples():
+                    name, key, value = sample[:3]
+                    extra = sample[3] if len(sample) > 3 else None
+                    lines.append(f"{name}{_format_labels(key, extra)} {value}")
+        typed = set()
+        for name, labels, value in self._collect():
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name}{_format_labels(_label_key(labels))} {value}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            data = {name: metric.to_dict() for name, metric in self._metrics.items()}
+        for name, labels, value in self._collect():
+            data.setdefault(name, {})[_format_labels(_label_key(labels)) or "value"] = value
+        return data
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def _collect(self) -> list:
+        samples = []
+        for collector in self._collectors:
+            try:
+                samples.extend(collector())
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+        return samples
+
+
+metrics = MetricsRegistry()
+
+STAGE_SECONDS = metrics.histogram(
+    "watermark_stage_seconds",
+    "Time spent per processing stage (get_file, download, settings, decode, render, encode, upload)",
+)
+JOBS = metrics.counter("watermark_jobs_total", "Processed media by kind and outcome")
+ERRORS = metrics.counter("watermark_errors_total", "Processing errors by kind")
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Observe the duration of the with-block as a processing stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+@contextmanager
+def timed(timings: dict, stage: str):
+    """Add the duration of the with-block to timings[stage]."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+def record_timings(timings: dict):
+    """Record stage timings measured elsewhere, e.g. in a render worker process."""
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+async def start_metrics_server(host: str = None, port: int = None):
+    """Serve /metrics and /metrics.json on their own port; returns the runner."""
+    from aiohttp import web
+    app = web.Application()
+    add_metrics_routes(app)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host or config.METRICS_HOST, port or config.METRICS_PORT).start()
+    logger.info(f"Metrics on http://{host or config.METRICS_HOST}:{port or config.METRICS_PORT}/metrics")
+    return runner
+
+
+def add_metrics_routes(app):
+    from aiohttp import web
+
+    async def prometheus(request):
+        return web.Response(text=metrics.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+    async def json_dump(request):
+        return web.json_response(metrics.to_dict())
+
+    app.router.add_get("/metrics", prometheus)
+    app.router.add_get("/metrics.json", json_dump)
@@ -1,8 +1,14 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Float, ForeignKey, Text, JSON
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Float, ForeignKey, Text, JSON, Index, select, insert, delete, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
 import json
+import logging
+import config
+
+logger = logging.getLogger(__name__)
 
 class User(Base):
     __tablename__ = "users"
@@ -62,3 +68,146 @@ class WatermarkSettings(Base):
     
     # Relationships
     user = relationship("User", back_populates="watermark_settings")
+    
+    # One settings row per user; lets get-or-create be a single upsert
+    __table_args__ = (
+        Index("uq_watermark_settings_user_id", "user_id", unique=True),
+    )
+
+
+# Repository helpers (take an AsyncSession from database.get_async_session)
+
+async def _upsert(db, model, conflict_column: str, values: dict):
+    """INSERT ... ON CONFLICT DO NOTHING for the session's dialect.
+
+    Returns the new row's id, or None if the row already existed.
+    """
+    dialect = db.bind.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = (
+            dialect_insert(model)
+            .values(**values)
+            .on_conflict_do_nothing(index_elements=[conflict_column])
+            .returning(model.id)
+        )
+        return (await db.execute(stmt)).scalar()
+    
+    # Other databases: plain insert, treating a unique violation as "exists"
+    try:
+        async with db.begin_nested():
+            return (await db.execute(insert(model).values(**values).returning(model.id))).scalar()
+    except IntegrityError:
+        return None
+
+
+async def get_user_with_settings(db, telegram_id: str) -> tuple:
+    """Fetch a user and their watermark settings in one joined query.
+    
+    Returns (user, settings); either may be None.
+    """
+    result = await db.execute(
+        select(User, WatermarkSettings)
+        .outerjoin(WatermarkSettings, WatermarkSettings.user_id == User.id)
+        .where(User.telegram_id == telegram_id)
+        .limit(1)
+    )
+    row = result.first()
+    if row is None:
+        return None, None
+    return row[0], row[1]
+
+
+async def ensure_watermark_settings(db, user_id: int) -> WatermarkSettings:
+    """Get a user's settings, creating the defaults with an upsert if missing."""
+    await _upsert(db, WatermarkSettings, "user_id", {"user_id": user_id, **config.DEFAULT_WATERMARK_SETTINGS})
+    await db.commit()
+    result = await db.execute(
+        select(WatermarkSettings).where(WatermarkSettings.user_id == user_id)
+    )
+    return result.scalar_one()
+
+
+async def get_or_create_user_with_settings(db, telegram_id: str, **user_fields) -> tuple:
+    """Get or create a user together with their settings.
+    
+    Returns (user, settings, created) where created is True when the user
+    row was inserted by this call.
+    """
+    new_id = await _upsert(db, User, "telegram_id", {"telegram_id": telegram_id, **user_fields})
+    if new_id is not None:
+        await _upsert(db, WatermarkSettings, "user_id", {"user_id": new_id, **config.DEFAULT_WATERMARK_SETTINGS})
+        await db.commit()
+    
+    user, settings = await get_user_with_settings(db, telegram_id)
+    if settings is None:
+        settings = await ensure_watermark_settings(db, user.id)
+    return user, settings, new_id is not None
+
+
+async def get_active_plan(db, telegram_id: str) -> str:
+    """Plan type of the user's newest active, unexpired subscription, or None."""
+    result = await db.execute(
+        select(Subscription.plan_type)
+        .join(User, Subscription.user_id == User.id)
+        .where(
+            User.telegram_id == telegram_id,
+            Subscription.status == "active",
+            (Subscription.expires_at.is_(None)) | (Subscription.expires_at > func.now()),
+        )
+        .order_by(Subscription.created_at.desc())
+        .limit(1)
+    )
+    return result.scalar()
+
+
+async def get_user_ids(db, telegram_ids: list) -> dict:
+    """Map Telegram ids to users.id in one query; unknown ids are left out."""
+    result = await db.execute(
+        select(User.telegram_id, User.id).where(User.telegram_id.in_(telegram_ids))
+    )
+    return dict(result.all())
+
+
+async def insert_usage(db, rows: list):
+    """Bulk insert Usage rows given as dicts."""
+    if rows:
+        await db.execute(insert(Usage), rows)
+        await db.commit()
+
+
+async def count_usage_since(db, telegram_id: str, since) -> int:
+    """Number of media the user processed since the given time."""
+    result = await db.execute(
+        select(func.count(Usage.id))
+        .join(User, Usage.user_id == User.id)
+        .where(User.telegram_id == telegram_id, Usage.processed_at >= since)
+    )
+    return result.scalar() or 0
+
+
+def remove_duplicate_settings(connection) -> int:
+    """Delete all but the newest watermark_settings row of each user."""
+    newest = select(func.max(WatermarkSettings.id)).group_by(WatermarkSettings.user_id)
+    result = connection.execute(delete(WatermarkSettings).where(WatermarkSettings.id.not_in(newest)))
+    return result.rowcount
+
+
+def create_missing_indexes(engine):
+    """Add indexes declared after a table was first created.
+
+    Duplicate settings rows left by the old get-or-create race are removed
+    first so the unique index can be built. Errors are raised: the settings
+    upsert's ON CONFLICT needs that index, so the bot can't run without it.
+    """
+    existing = {index['name'] for index in inspect(engine).get_indexes(WatermarkSettings.__tablename__)}
+    with engine.begin() as connection:
+        for index in WatermarkSettings.__table__.indexes:
+            if index.name in existing:
+                continue
+            if index.unique:
+                removed = remove_duplicate_settings(connection)
+                if removed:
+                    logger.warning(f"Removed {removed} duplicate watermark_settings rows")
+            index.create(bind=connection)
+            logger.info(f"Created index {index.name}")
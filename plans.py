@@ -0,0 +1,75 @@
+import asyncio
+import time
+from collections import OrderedDict
+from database import get_async_session
+from models import get_active_plan
+import config
+
+
+def plan_policy(plan: str) -> dict:
+    """Scheduling and media limits for a plan; unknown plans get the free tier."""
+    return config.PLAN_POLICIES.get(plan, config.PLAN_POLICIES[config.DEFAULT_PLAN])
+
+
+def check_video_limits(plan: str, duration: int, height: int) -> str:
+    """Return why a video exceeds the plan's limits, or None if it is allowed.
+
+    height is the short side, so portrait and landscape 720p count the same.
+    """
+    policy = plan_policy(plan)
+    max_duration = policy['max_video_duration']
+    max_height = policy['max_video_height']
+    if max_duration and duration and duration > max_duration:
+        return f"Videos on the {plan} plan can be up to {max_duration} seconds long."
+    if max_height and height and height > max_height:
+        return f"Videos on the {plan} plan can be up to {max_height}p."
+    return None
+
+
+class PlanCache:
+    """TTL + LRU cache of each user's active subscription plan.
+
+    Jobs look up the plan on every submission, so it has to be a memory
+    hit nearly always. Users without an active subscription are cached as
+    DEFAULT_PLAN too.
+    """
+
+    def __init__(self, ttl: float = None, max_entries: int = None):
+        self.ttl = config.PLAN_CACHE_TTL if ttl is None else ttl
+        self.max_entries = config.SETTINGS_CACHE_SIZE if max_entries is None else max_entries
+        self._entries = OrderedDict()
+        self._loading = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get_plan(self, telegram_id: str) -> str:
+        entry = self._entries.get(telegram_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(telegram_id)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        loading = self._loading.get(telegram_id)
+        if loading is None:
+            loading = asyncio.ensure_future(self._load(telegram_id))
+            self._loading[telegram_id] = loading
+            loading.add_done_callback(lambda _: self._loading.pop(telegram_id, None))
+        plan = await asyncio.shield(loading)
+
+        self._entries[telegram_id] = (time.monotonic() + self.ttl, plan)
+        self._entries.move_to_end(telegram_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return plan
+
+    def invalidate(self, telegram_id: str):
+        self._entries.pop(telegram_id, None)
+
+    async def _load(self, telegram_id: str) -> str:
+        async with get_async_session() as db:
+            plan = await get_active_plan(db, telegram_id)
+        return plan if plan in config.PLAN_POLICIES else config.DEFAULT_PLAN
+
+
+plan_cache = PlanCache()
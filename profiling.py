@@ -0,0 +1,107 @@
+import cProfile
+import io
+import itertools
+import logging
+import os
+import pstats
+import config
+
+try:
+    from pyinstrument import Profiler as PyInstrumentProfiler
+except ImportError:  # optional; cProfile is used instead
+    PyInstrumentProfiler = None
+
+logger = logging.getLogger(__name__)
+
+# Both profilers hook the whole interpreter, so only one request is
+# profiled at a time; others run unprofiled meanwhile.
+_active = False
+
+
+class RequestProfiler:
+    """Profiles one request on the event loop.
+
+    Uses pyinstrument (statistical, async-aware, HTML flame report) when it
+    is installed, otherwise cProfile with a top-N text report. Time spent in
+    render worker processes shows up as awaiting; the per-stage metrics
+    cover those.
+
+    cProfile is not async-aware: it records everything the event loop thread
+    runs while enabled, so with CONCURRENT_UPDATES > 1 its report also
+    includes other users' handlers and jobs. Install pyinstrument for
+    per-request reports on a busy bot.
+    """
+
+    def __init__(self, top_n: int = None):
+        self.top_n = top_n or config.PROFILE_TOP_N
+        self.kind = "pyinstrument" if PyInstrumentProfiler is not None else "cprofile"
+        self._profiler = None
+
+    def start(self) -> bool:
+        """Start profiling; False if another request is being profiled."""
+        global _active
+        if _active:
+            return False
+        _active = True
+        if self.kind == "pyinstrument":
+            self._profiler = PyInstrumentProfiler(async_mode="enabled")
+            self._profiler.start()
+        else:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return True
+
+    def stop(self):
+        global _active
+        if self.kind == "pyinstrument":
+            self._profiler.stop()
+        else:
+            self._profiler.disable()
+        _active = False
+
+    def report(self) -> tuple:
+        """The report as (filename, bytes) for sending as a document."""
+        if self.kind == "pyinstrument":
+            return "profile.html", self._profiler.output_html().encode("utf-8")
+        output = io.StringIO()
+        if config.CONCURRENT_UPDATES > 1:
+            output.write("Note: cProfile covers the whole event loop thread, so this report "
+                         "includes other updates processed concurrently. Install pyinstrument "
+                         "for a per-request profile.\n\n")
+        stats = pstats.Stats(self._profiler, stream=output)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top_n)
+        return "profile.txt", output.getvalue().encode("utf-8")
+
+    def save(self, name: str) -> str:
+        """Write the profile to PROFILE_DIR and return its path.
+
+        cProfile data is saved raw (.prof) so it can be opened with pstats
+        or snakeviz later.
+        """
+        os.makedirs(config.PROFILE_DIR, exist_ok=True)
+        if self.kind == "pyinstrument":
+            path = os.path.join(config.PROFILE_DIR, f"{name}.html")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self._profiler.output_html())
+        else:
+            path = os.path.join(config.PROFILE_DIR, f"{name}.prof")
+            self._profiler.dump_stats(path)
+        return path
+
+
+class ProfileSampler:
+    """Picks every PROFILE_SAMPLE_EVERY-th request; 0 turns sampling off.
+
+    Sampling needs pyinstrument: cProfile would trace every call on the
+    event loop thread, slowing all users while a sampled render runs.
+    """
+
+    def __init__(self, every: int = None):
+        self.every = config.PROFILE_SAMPLE_EVERY if every is None else every
+        if self.every > 0 and PyInstrumentProfiler is None:
+            logger.warning("PROFILE_SAMPLE_EVERY is set but pyinstrument isn't installed; sampling is off")
+            self.every = 0
+        self._count = itertools.count(1)
+
+    def should_sample(self) -> bool:
+        return self.every > 0 and next(self._count) % self.every == 0
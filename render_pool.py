@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from logging_setup import correlation_id, run_with_correlation, setup_logging
+from metrics import record_timings
+import config
+
+logger = logging.getLogger(__name__)
+
+# Per-worker warm state. Each worker process (or the thread lane, which
+# shares one instance) keeps its own MediaProcessor so fonts and other
+# lazily built resources survive between jobs.
+_worker_processor = None
+_worker_lock = threading.Lock()
+
+
+def _init_worker():
+    """Build the warm MediaProcessor for this worker."""
+    global _worker_processor
+    with _worker_lock:
+        if _worker_processor is None:
+            # Spawned workers start with unconfigured logging
+            setup_logging()
+            from media_processor import MediaProcessor
+            _worker_processor = MediaProcessor()
+            _worker_processor.warm_up()
+
+
+def _get_worker_processor():
+    if _worker_processor is None:
+        _init_worker()
+    return _worker_processor
+
+
+# Jobs return (result, stage timings, worker stats); both are recorded in
+# the parent process, where the metrics are served. The worker stats are
+# (pid, stamp cache stats), since each worker has its own stamp cache.
+
+def _worker_stats() -> tuple:
+    return os.getpid(), _get_worker_processor().stamp_cache.stats()
+
+
+def _render_image_job(file_path: str, settings: dict, max_side: int = None) -> tuple:
+    timings = {}
+    result = _get_worker_processor().render_image(file_path, settings, max_side, timings)
+    return result, timings, _worker_stats()
+
+
+def _render_image_bytes_job(data: bytes, settings: dict, max_side: int = None) -> tuple:
+    timings = {}
+    result = _get_worker_processor().render_image_bytes(data, settings, max_side, timings)
+    return result, timings, _worker_stats()
+
+
+def _render_video_job(file_path: str, settings: dict) -> tuple:
+    timings = {}
+    result = _get_worker_processor().render_video(file_path, settings, timings)
+    return result, timings, _worker_stats()
+
+
+def _warm_up_job() -> bool:
+    _get_worker_processor()
+    return True
+
+
+class RenderPool:
+    """Runs PIL and OpenCV rendering off the event loop.
+
+    Images go to a process pool (or a thread pool when RENDER_EXECUTOR is
+    "thread"); videos go to a thread pool because OpenCV releases the GIL
+    while decoding and encoding. At most RENDER_QUEUE_SIZE jobs are
+    submitted at once; further callers wait for a free slot.
+    """
+
+    def __init__(self, image_workers: int = None, video_workers: int = None,
+                 executor_kind: str = None, queue_size: int = None):
+        self.image_workers = max(1, image_workers or config.RENDER_WORKERS)
+        self.video_workers = max(1, video_workers or config.VIDEO_RENDER_WORKERS)
+        self.executor_kind = executor_kind or config.RENDER_EXECUTOR
+        self.queue_size = max(1, queue_size or config.RENDER_QUEUE_SIZE)
+        self._image_executor = None
+        self._video_executor = None
+        self._slots = None
+        self._stamp_stats = {}  # worker pid -> its stamp cache stats after its last job
+
+    def start(self):
+        """Create the executors. Safe to call more than once."""
+        if self._image_executor is not None and self._video_executor is not None:
+            return
+        if self._image_executor is None:
+            if self.executor_kind == "process":
+                self._image_executor = ProcessPoolExecutor(
+                    max_workers=self.image_workers,
+                    mp_context=multiprocessing.get_context(config.RENDER_START_METHOD),
+                    initializer=_init_worker,
+                )
+            else:
+                self._image_executor = ThreadPoolExecutor(
+                    max_workers=self.image_workers,
+                    thread_name_prefix="render-image",
+                    initializer=_init_worker,
+                )
+        if self._video_executor is None:
+            self._video_executor = ThreadPoolExecutor(
+                max_workers=self.video_workers,
+                thread_name_prefix="render-video",
+                initializer=_init_worker,
+            )
+        logger.info(
+            f"Render pool started: {self.image_workers} {self.executor_kind} image workers, "
+            f"{self.video_workers} video threads, queue size {self.queue_size}"
+        )
+
+    async def warm_up(self):
+        """Start every image worker so the first job doesn't pay for it."""
+        self.start()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[
+            loop.run_in_executor(self._image_executor, _warm_up_job)
+            for _ in range(self.image_workers)
+        ])
+
+    async def render_image(self, file_path: str, settings: dict, max_side: int = None) -> str:
+        """Render a watermarked image in the image pool."""
+        return await self._submit("image", _render_image_job, file_path, settings, max_side)
+
+    async def render_image_bytes(self, data: bytes, settings: dict, max_side: int = None) -> bytes:
+        """Render a watermarked image held in memory in the image pool."""
+        return await self._submit("image", _render_image_bytes_job, data, settings, max_side)
+
+    async def render_video(self, file_path: str, settings: dict) -> str:
+        """Render a watermarked video in the video pool."""
+        return await self._submit("video", _render_video_job, file_path, settings)
+
+    async def _submit(self, lane: str, fn, *args):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.queue_size)
+        async with self._slots:
+            self.start()
+            executor = self._video_executor if lane == "video" else self._image_executor
+            loop = asyncio.get_running_loop()
+            try:
+                # run_in_executor doesn't carry context variables over
+                result, timings, (pid, stamp_stats) = await loop.run_in_executor(
+                    executor, run_with_correlation, correlation_id.get(), fn, *args
+                )
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for using too much memory). The
+                # jobs it took down fail; later jobs get a fresh pool.
+                self._replace_broken_executor(executor)
+                raise
+        record_timings(timings)
+        self._stamp_stats[pid] = stamp_stats
+        return result
+
+    def stamp_cache_stats(self) -> dict:
+        """Stamp cache stats summed over the workers that have run a job."""
+        totals = {}
+        for stats in self._stamp_stats.values():
+            for field, value in stats.items():
+                totals[field] = totals.get(field, 0) + value
+        return totals
+
+    def _replace_broken_executor(self, executor):
+        if self._image_executor is not executor:
+            return  # another job already replaced it
+        logger.error("Render worker died; restarting the image pool")
+        self._image_executor = None
+        self._stamp_stats.clear()  # the new workers start with empty caches
+        executor.shutdown(wait=False, cancel_futures=True)
+        self.start()
+
+    def shutdown(self, wait: bool = True):
+        """Stop the executors, dropping jobs that haven't started yet."""
+        for executor in (self._image_executor, self._video_executor):
+            if executor is not None:
+                executor.shutdown(wait=wait, cancel_futures=True)
+        self._image_executor = None
+        self._video_executor = None
+        logger.info("Render pool stopped")
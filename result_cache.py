@@ -0,0 +1,61 @@
+import time
+from collections import OrderedDict
+from settings_cache import settings_fingerprint
+import config
+
+
+class ResultCache:
+    """Maps (media kind, source file_unique_id, settings) to the Telegram
+    file_id of the watermarked output we already sent.
+
+    Re-sending a file_id needs no download, render or upload. Entries
+    expire after RESULT_CACHE_MAX_AGE seconds and the least recently used
+    ones are dropped beyond RESULT_CACHE_SIZE.
+    """
+
+    def __init__(self, max_entries: int = None, max_age: float = None):
+        self.max_entries = config.RESULT_CACHE_SIZE if max_entries is None else max_entries
+        self.max_age = config.RESULT_CACHE_MAX_AGE if max_age is None else max_age
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(kind: str, file_unique_id: str, settings: dict):
+        """Cache key for a render, or None if the source can't be identified."""
+        if not file_unique_id:
+            return None
+        return (kind, file_unique_id, settings_fingerprint(settings))
+
+    def get(self, key) -> str:
+        """Return the cached output file_id for key, or None."""
+        if key is None:
+            return None
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic() - self.max_age:
+            if entry is not None:
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, file_id: str):
+        if key is None or not file_id:
+            return
+        self._entries[key] = (time.monotonic(), file_id)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
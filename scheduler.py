@@ -0,0 +1,181 @@
+import asyncio
+import bisect
+import contextvars
+import itertools
+import logging
+import math
+from collections import Counter
+from plans import plan_policy
+import config
+
+logger = logging.getLogger(__name__)
+
+LANES = ("image", "video")
+
+
+class Job:
+    def __init__(self, seq: int, user_id: str, lane: str, key, factory, on_position, plan: str):
+        self.seq = seq
+        self.user_id = user_id
+        self.lane = lane
+        self.plan = plan
+        self.priority = plan_policy(plan)['priority']
+        self.key = key
+        self.factory = factory
+        self.on_position = on_position
+        self.position = None
+        self.future = asyncio.get_running_loop().create_future()
+        # The job runs in the submitter's context (e.g. its log correlation id)
+        self.context = contextvars.copy_context()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class JobScheduler:
+    """Fair queue in front of media processing.
+
+    - at most MAX_CONCURRENT_JOBS jobs run at once, and each lane has its own
+      cap (IMAGE_LANE_SLOTS / VIDEO_LANE_SLOTS), so slow video jobs can never
+      take every slot from photos;
+    - each user has at most MAX_JOBS_PER_USER jobs running; among queued
+      jobs of the same priority the one whose user has the fewest running
+      goes first;
+    - queues are ordered by the user's plan priority, then arrival, so
+      paying users' jobs go ahead of queued free-tier jobs; while jobs of a
+      better plan wait in a lane, a plan may hold at most its "share" of
+      that lane's slots, otherwise it may use them all;
+    - submitting a job whose key matches one that is queued or running joins
+      that job instead of adding another;
+    - on_position(n) is called when a job's place in its lane queue changes,
+      and with 0 when it starts after having waited.
+
+    Handlers should enqueue() and return rather than await the job: while a
+    handler waits, that user's later updates wait behind it, so nothing but
+    one job per user could ever be queued.
+    """
+
+    def __init__(self, max_concurrent: int = None, per_user: int = None, lane_slots: dict = None):
+        self.max_concurrent = max_concurrent or config.MAX_CONCURRENT_JOBS
+        self.per_user = per_user or config.MAX_JOBS_PER_USER
+        self.lane_slots = lane_slots or {
+            "image": config.IMAGE_LANE_SLOTS,
+            "video": config.VIDEO_LANE_SLOTS,
+        }
+        self._queues = {lane: [] for lane in LANES}
+        self._jobs = {}
+        self._running = Counter()
+        self._running_per_user = Counter()
+        self._running_per_plan = Counter()
+        self._seq = itertools.count()
+        self.deduplicated = 0
+
+    async def submit(self, user_id: str, lane: str, factory, key=None, on_position=None,
+                     plan: str = None):
+        """Queue factory() and wait for its result."""
+        return await asyncio.shield(self.enqueue(user_id, lane, factory, key, on_position, plan))
+
+    def enqueue(self, user_id: str, lane: str, factory, key=None, on_position=None,
+                plan: str = None) -> asyncio.Future:
+        """Queue factory() without waiting; returns the job's future.
+
+        If a job with the same key is queued or running, its future is
+        returned instead. Failures nobody awaits are logged.
+        """
+        if key is not None and key in self._jobs:
+            self.deduplicated += 1
+            return self._jobs[key].future
+
+        job = Job(next(self._seq), user_id, lane, key, factory, on_position,
+                  plan or config.DEFAULT_PLAN)
+        job.future.add_done_callback(self._log_failure)
+        if key is not None:
+            self._jobs[key] = job
+        bisect.insort(self._queues[lane], job)
+        self._dispatch()
+        self._report_positions()
+        return job.future
+
+    def queue_depth(self) -> dict:
+        """Queued and running jobs per lane."""
+        return {
+            lane: {'queued': len(self._queues[lane]), 'running': self._running[lane]}
+            for lane in LANES
+        }
+
+    def _next_job(self):
+        for lane in LANES:
+            if self._running[lane] >= self.lane_slots[lane]:
+                continue
+            queue = self._queues[lane]
+            ready = [job for job in queue
+                     if self._running_per_user[job.user_id] < self.per_user
+                     and self._within_share(job, queue)]
+            if ready:
+                job = min(ready, key=lambda j: (j.priority, self._running_per_user[j.user_id], j.seq))
+                self._queues[lane].remove(job)
+                return job
+        return None
+
+    def _within_share(self, job: Job, queue: list) -> bool:
+        # Shares only hold slots back for better plans' jobs that are waiting
+        if not any(other.priority < job.priority for other in queue):
+            return True
+        return self._running_per_plan[job.lane, job.plan] < self._plan_slots(job.plan, job.lane)
+
+    def _plan_slots(self, plan: str, lane: str) -> int:
+        return max(1, math.floor(plan_policy(plan)['share'] * self.lane_slots[lane]))
+
+    def _dispatch(self):
+        while sum(self._running.values()) < self.max_concurrent:
+            job = self._next_job()
+            if job is None:
+                return
+            self._running[job.lane] += 1
+            self._running_per_user[job.user_id] += 1
+            self._running_per_plan[job.lane, job.plan] += 1
+            if job.position is not None:
+                self._notify(job, 0)
+            asyncio.get_running_loop().create_task(self._run(job), context=job.context)
+
+    async def _run(self, job: Job):
+        try:
+            job.future.set_result(await job.factory())
+        except asyncio.CancelledError:
+            job.future.cancel()
+            raise
+        except Exception as e:
+            job.future.set_exception(e)
+        finally:
+            self._running[job.lane] -= 1
+            self._running_per_user[job.user_id] -= 1
+            self._running_per_plan[job.lane, job.plan] -= 1
+            if self._running_per_user[job.user_id] <= 0:
+                del self._running_per_user[job.user_id]
+            if job.key is not None and self._jobs.get(job.key) is job:
+                del self._jobs[job.key]
+            self._dispatch()
+            self._report_positions()
+
+    @staticmethod
+    def _log_failure(future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Scheduled job failed: {future.exception()}")
+
+    def _report_positions(self):
+        for queue in self._queues.values():
+            for index, job in enumerate(queue, start=1):
+                if job.position != index:
+                    self._notify(job, index)
+
+    def _notify(self, job: Job, position: int):
+        job.position = position
+        if job.on_position is not None:
+            asyncio.ensure_future(self._call_position(job.on_position, position))
+
+    @staticmethod
+    async def _call_position(callback, position: int):
+        try:
+            await callback(position)
+        except Exception as e:
+            logger.debug(f"Queue position update failed: {e}")
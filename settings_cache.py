@@ -0,0 +1,140 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from database import get_async_session
+from metrics import stage_timer
+from models import WatermarkSettings, ensure_watermark_settings, get_user_with_settings
+import config
+
+SETTING_FIELDS = ('text', 'font_size', 'opacity', 'position', 'color', 'font_family')
+
+
+def settings_to_dict(settings: WatermarkSettings) -> dict:
+    """Extract plain values from a WatermarkSettings row."""
+    return {field: getattr(settings, field) for field in SETTING_FIELDS}
+
+
+def settings_fingerprint(settings: dict) -> str:
+    """Stable hash of the fields that affect how a watermark is rendered."""
+    payload = json.dumps({field: settings.get(field) for field in SETTING_FIELDS}, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class PendingLoad:
+    """A database load shared by concurrent misses for one user."""
+
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        # Set when the settings are written while the load runs; the row it
+        # read may predate the write
+        self.stale = False
+
+
+class SettingsCache:
+    """Write-through TTL + LRU cache of watermark settings per Telegram user.
+
+    get_settings() answers from memory while an entry is fresh; updates go
+    to the database and the cache together, so readers never see stale
+    values written through this process.
+    """
+
+    def __init__(self, ttl: float = None, max_entries: int = None):
+        self.ttl = config.SETTINGS_CACHE_TTL if ttl is None else ttl
+        self.max_entries = config.SETTINGS_CACHE_SIZE if max_entries is None else max_entries
+        self._entries = OrderedDict()
+        self._loading = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get_settings(self, telegram_id: str) -> dict:
+        """Return the user's settings, or None if the user doesn't exist yet."""
+        entry = self._entries.get(telegram_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(telegram_id)
+            self.hits += 1
+            return dict(entry[1])
+
+        self.misses += 1
+        # Concurrent misses for the same user share one query
+        pending = self._loading.get(telegram_id)
+        if pending is None:
+            pending = PendingLoad(asyncio.ensure_future(self._load(telegram_id)))
+            self._loading[telegram_id] = pending
+            pending.future.add_done_callback(lambda _: self._finish_load(telegram_id, pending))
+        settings = await asyncio.shield(pending.future)
+        if pending.stale:
+            # Don't let an older row overwrite what was written meanwhile
+            entry = self._entries.get(telegram_id)
+            if entry is not None:
+                return dict(entry[1])
+            return await self.get_settings(telegram_id)
+        if settings is None:
+            self._entries.pop(telegram_id, None)
+            return None
+        self._store(telegram_id, settings)
+        return dict(settings)
+
+    async def update_settings(self, telegram_id: str, **changes) -> dict:
+        """Write changed fields to the database and the cache.
+
+        Returns the new settings, or None if the user doesn't exist.
+        """
+        async with get_async_session() as db:
+            user, settings = await get_user_with_settings(db, telegram_id)
+            if not user:
+                self.invalidate(telegram_id)
+                return None
+            if not settings:
+                settings = await ensure_watermark_settings(db, user.id)
+            for field, value in changes.items():
+                setattr(settings, field, value)
+            values = settings_to_dict(settings)
+            await db.commit()
+
+        self._mark_stale(telegram_id)
+        self._store(telegram_id, values)
+        return dict(values)
+
+    def prime(self, telegram_id: str, settings: dict):
+        """Store settings that were just read from the database."""
+        self._mark_stale(telegram_id)
+        self._store(telegram_id, dict(settings))
+
+    def invalidate(self, telegram_id: str):
+        self._mark_stale(telegram_id)
+        self._entries.pop(telegram_id, None)
+
+    def stats(self) -> dict:
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+    def _mark_stale(self, telegram_id: str):
+        # Later misses start a fresh load instead of joining this one
+        pending = self._loading.pop(telegram_id, None)
+        if pending is not None:
+            pending.stale = True
+
+    def _finish_load(self, telegram_id: str, pending: PendingLoad):
+        if self._loading.get(telegram_id) is pending:
+            del self._loading[telegram_id]
+
+    def _store(self, telegram_id: str, settings: dict):
+        self._entries[telegram_id] = (time.monotonic() + self.ttl, settings)
+        self._entries.move_to_end(telegram_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _load(self, telegram_id: str) -> dict:
+        with stage_timer("settings"):
+            async with get_async_session() as db:
+                user, settings = await get_user_with_settings(db, telegram_id)
+                if not user:
+                    return None
+                if not settings:
+                    # Create default settings if not exist
+                    settings = await ensure_watermark_settings(db, user.id)
+                return settings_to_dict(settings)
+
+
+settings_cache = SettingsCache()
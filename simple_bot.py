@@ -1,26 +1,59 @@
 import os
+import time
 import logging
 import asyncio
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, CallbackQueryHandler, 
     ContextTypes, filters
 )
 from telegram.constants import ParseMode
 from media_processor import MediaProcessor
-from database import get_db_session
-from models import User, WatermarkSettings
+from logging_setup import log_context
+from metrics import ERRORS, JOBS, metrics, stage_timer, start_metrics_server
+from profiling import ProfileSampler, RequestProfiler
+from plans import check_video_limits, plan_cache, plan_policy
+from render_pool import RenderPool
+from result_cache import ResultCache
+from scheduler import JobScheduler
+from source_cache import SourceCache
+from usage import UsageRecorder
+from database import dispose_async_engine, get_async_session
+from models import get_or_create_user_with_settings
+from settings_cache import settings_cache, settings_fingerprint, settings_to_dict
 import config
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 class SimpleBotHandler:
     def __init__(self):
-        self.media_processor = MediaProcessor()
+        self.render_pool = RenderPool()
+        self.media_processor = MediaProcessor(render_pool=self.render_pool)
+        self.result_cache = ResultCache()
+        self.source_cache = SourceCache()
+        self.scheduler = JobScheduler()
+        self.usage = UsageRecorder()
+        self.albums = {}
+        self.metrics_runner = None
+        self.profile_requests = {}  # user id -> chat id of the admin waiting for the report
+        self.profile_sampler = ProfileSampler()
+        metrics.register_collector(self.collect_metrics)
+    
+    async def post_init(self, application):
+        """Start background resources once the application is initialized."""
+        await self.render_pool.warm_up()
+        self.usage.start()
+        if config.METRICS_PORT:
+            self.metrics_runner = await start_metrics_server()
+    
+    async def post_shutdown(self, application):
+        """Release background resources when the application stops."""
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+        self.render_pool.shutdown()
+        self.source_cache.clear()
+        await self.usage.stop()
+        await dispose_async_engine()
     
     def setup_handlers(self, application):
         """Setup all bot handlers."""
@@ -28,6 +61,7 @@ class SimpleBotHandler:
         application.add_handler(CommandHandler("help", self.help_command))
         application.add_handler(CommandHandler("settings", self.settings_command))
         application.add_handler(CommandHandler("menu", self.menu_command))
+        application.add_handler(CommandHandler("profile", self.profile_command))
         application.add_handler(MessageHandler(filters.PHOTO, self.handle_photo))
         application.add_handler(MessageHandler(filters.VIDEO, self.handle_video))
         application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_text))
@@ -38,30 +72,19 @@ class SimpleBotHandler:
         user = update.effective_user
         user_id = str(user.id)
         
-        # Create or get user from database
-        db = get_db_session()
-        try:
-            db_user = db.query(User).filter(User.telegram_id == user_id).first()
-            if not db_user:
-                # Create new user
-                db_user = User(
-                    telegram_id=user_id,
-                    username=user.username,
-                    first_name=user.first_name,
-                    last_name=user.last_name
-                )
-                db.add(db_user)
-                db.commit()
-                
-                # Create default watermark settings
-                watermark_settings = WatermarkSettings(
-                    user_id=db_user.id,
-                    **config.DEFAULT_WATERMARK_SETTINGS
-                )
-                db.add(watermark_settings)
-                db.commit()
-                
-                welcome_text = f"""
+        # Create or get user and settings from database
+        async with get_async_session() as db:
+            _, settings, created = await get_or_create_user_with_settings(
+                db,
+                user_id,
+                username=user.username,
+                first_name=user.first_name,
+                last_name=user.last_name
+            )
+        settings_cache.prime(user_id, settings_to_dict(settings))
+        
+        if created:
+            welcome_text = f"""
 🎉 Welcome to Watermark Bot, {user.first_name}!
 
 I can add custom watermarks to your photos and videos.
@@ -70,8 +93,8 @@ I can add custom watermarks to your photos and videos.
 ⚙️ Use /settings to customize your watermark
 ❓ Use /help for more information
 """
-            else:
-                welcome_text = f"""
+        else:
+            welcome_text = f"""
 👋 Welcome back, {user.first_name}!
 
 I'm ready to add watermarks to your photos and videos.
@@ -80,8 +103,6 @@ I'm ready to add watermarks to your photos and videos.
 ⚙️ Use /settings to customize your watermark
 ❓ Use /help for more information
 """
-        finally:
-            db.close()
         
         await update.message.reply_text(welcome_text)
         await self.show_main_menu(update, context)
@@ -125,17 +146,9 @@ I'm ready to add watermarks to your photos and videos.
         user_id = str(update.effective_user.id)
         
         # Get current user settings
-        db = get_db_session()
-        try:
-            user = db.query(User).filter(User.telegram_id == user_id).first()
-            if not user:
-                return
-            
-            settings = db.query(WatermarkSettings).filter(WatermarkSettings.user_id == user.id).first()
-            if not settings:
-                return
-        finally:
-            db.close()
+        settings = await settings_cache.get_settings(user_id)
+        if not settings:
+            return
         
         keyboard = [
             [
@@ -156,11 +169,11 @@ I'm ready to add watermarks to your photos and videos.
 🎯 **Watermark Bot Main Menu**
 
 **Current Settings Preview:**
-📝 Text: `{settings.text}`
-📏 Size: `{settings.font_size}px`
-👻 Opacity: `{int((settings.opacity/255)*100)}%`
-📍 Position: `{settings.position.replace('_', ' ').title()}`
-🎨 Color: `{settings.color.title()}`
+📝 Text: `{settings['text']}`
+📏 Size: `{settings['font_size']}px`
+👻 Opacity: `{int((settings['opacity']/255)*100)}%`
+📍 Position: `{settings['position'].replace('_', ' ').title()}`
+🎨 Color: `{settings['color'].title()}`
 
 Choose an option below or send a photo/video to start:
 """
@@ -175,20 +188,10 @@ Choose an option below or send a photo/video to start:
         """Handle /settings command."""
         user_id = str(update.effective_user.id)
         
-        db = get_db_session()
-        try:
-            user = db.query(User).filter(User.telegram_id == user_id).first()
-            if not user:
-                await update.message.reply_text("Please start the bot first with /start")
-                return
-            
-            settings = db.query(WatermarkSettings).filter(WatermarkSettings.user_id == user.id).first()
-            if not settings:
-                settings = WatermarkSettings(user_id=user.id, **config.DEFAULT_WATERMARK_SETTINGS)
-                db.add(settings)
-                db.commit()
-        finally:
-            db.close()
+        settings = await settings_cache.get_settings(user_id)
+        if not settings:
+            await update.message.reply_text("Please start the bot first with /start")
+            return
         
         keyboard = [
             [InlineKeyboardButton("📝 Change Text", callback_data="setting_text")],
@@ -202,11 +205,11 @@ Choose an option below or send a photo/video to start:
         settings_text = f"""
 ⚙️ **Current Watermark Settings**
 
-📝 Text: `{settings.text}`
-📏 Font Size: `{settings.font_size}`
-👻 Opacity: `{settings.opacity}/255`
-📍 Position: `{settings.position}`
-🎨 Color: `{settings.color}`
+📝 Text: `{settings['text']}`
+📏 Font Size: `{settings['font_size']}`
+👻 Opacity: `{settings['opacity']}/255`
+📍 Position: `{settings['position']}`
+🎨 Color: `{settings['color']}`
 
 Choose what you want to change:
 """
@@ -219,31 +222,28 @@ Choose what you want to change:
     
     async def handle_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle photo messages."""
+        # Photos sent as an album are collected and offered together
+        if update.message.media_group_id:
+            self.collect_album_photo(update, context)
+            return
+        
         # Clear any previous pending media to avoid confusion
+        context.user_data.pop('pending_album', None)
         if 'pending_video' in context.user_data:
             del context.user_data['pending_video']
             
         # Store photo info for later processing
         photo = update.message.photo[-1]
         context.user_data['pending_photo'] = photo.file_id
+        context.user_data['pending_unique_id'] = photo.file_unique_id
         
         # Get current user settings
         user_id = str(update.effective_user.id)
-        db = get_db_session()
-        try:
-            user = db.query(User).filter(User.telegram_id == user_id).first()
-            if user:
-                settings = db.query(WatermarkSettings).filter(WatermarkSettings.user_id == user.id).first()
-                if not settings:
-                    settings = WatermarkSettings(user_id=user.id, **config.DEFAULT_WATERMARK_SETTINGS)
-                    db.add(settings)
-                    db.commit()
-            else:
-                # Create user if doesn't exist
-                await self.start_command(update, context)
-                return
-        finally:
-            db.close()
+        settings = await settings_cache.get_settings(user_id)
+        if not settings:
+            # Create user if doesn't exist
+            await self.start_command(update, context)
+            return
         
         # Show customization options
         keyboard = [
@@ -260,6 +260,7 @@ Choose what you want to change:
                 InlineKeyboardButton("👻 Opacity", callback_data="quick_opacity")
             ],
             [
+                InlineKeyboardButton("📄 Full Resolution", callback_data="apply_watermark_full"),
                 InlineKeyboardButton("⚙️ Advanced Settings", callback_data="settings_menu")
             ]
         ]
@@ -269,11 +270,90 @@ Choose what you want to change:
 📸 **Image received!**
 
 **Current watermark settings:**
-📝 Text: `{settings.text}`
-📏 Font Size: `{settings.font_size}`
-📍 Position: `{settings.position.replace('_', ' ').title()}`
-🎨 Color: `{settings.color.title()}`
-👻 Opacity: `{settings.opacity}/255`
+📝 Text: `{settings['text']}`
+📏 Font Size: `{settings['font_size']}`
+📍 Position: `{settings['position'].replace('_', ' ').title()}`
+🎨 Color: `{settings['color'].title()}`
+👻 Opacity: `{settings['opacity']}/255`
+
+Choose an option below:
+"""
+        
+        await update.message.reply_text(
+            preview_text,
+            reply_markup=reply_markup,
+            parse_mode=ParseMode.MARKDOWN
+        )
+    
+    def collect_album_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Add a photo to its media group; the group is offered once complete."""
+        photo = update.message.photo[-1]
+        album = self.albums.setdefault(update.message.media_group_id, {'items': [], 'task': None})
+        album['items'].append((update.message.message_id, photo.file_id, photo.file_unique_id))
+        
+        # Telegram delivers album items as separate updates in quick succession;
+        # wait until no more arrive before showing the options
+        if album['task'] is not None:
+            album['task'].cancel()
+        album['task'] = context.application.create_task(
+            self.show_album_options(update, context, update.message.media_group_id),
+            update=update
+        )
+    
+    async def show_album_options(self, update: Update, context: ContextTypes.DEFAULT_TYPE, media_group_id: str):
+        """Store a collected album as the pending media and show the options.
+        
+        Runs as a background task, so the pending media is changed under the
+        user's update lock; the reply is sent after releasing it.
+        """
+        await asyncio.sleep(config.ALBUM_COLLECT_DELAY)
+        async with context.application.update_processor.user_lock(update.effective_user.id):
+            album = self.albums.pop(media_group_id)
+            items = [(file_id, unique_id) for _, file_id, unique_id in sorted(album['items'])]
+            
+            # Clear any previous pending media to avoid confusion
+            context.user_data.pop('pending_photo', None)
+            context.user_data.pop('pending_video', None)
+            context.user_data.pop('pending_unique_id', None)
+            context.user_data['pending_album'] = items
+        
+        # Get current user settings
+        user_id = str(update.effective_user.id)
+        settings = await settings_cache.get_settings(user_id)
+        if not settings:
+            # Create user if doesn't exist
+            await self.start_command(update, context)
+            return
+        
+        # Show customization options
+        keyboard = [
+            [
+                InlineKeyboardButton("✅ Apply Watermark", callback_data="apply_watermark"),
+                InlineKeyboardButton("📝 Change Text", callback_data="quick_text")
+            ],
+            [
+                InlineKeyboardButton("📏 Font Size", callback_data="quick_font_size"),
+                InlineKeyboardButton("📍 Position", callback_data="quick_position")
+            ],
+            [
+                InlineKeyboardButton("🎨 Color", callback_data="quick_color"),
+                InlineKeyboardButton("👻 Opacity", callback_data="quick_opacity")
+            ],
+            [
+                InlineKeyboardButton("⚙️ Advanced Settings", callback_data="settings_menu")
+            ]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        preview_text = f"""
+🖼 **Album of {len(items)} photos received!**
+
+**Current watermark settings:**
+📝 Text: `{settings['text']}`
+📏 Font Size: `{settings['font_size']}`
+📍 Position: `{settings['position'].replace('_', ' ').title()}`
+🎨 Color: `{settings['color'].title()}`
+👻 Opacity: `{settings['opacity']}/255`
 
 Choose an option below:
 """
@@ -293,30 +373,29 @@ Choose an option below:
             )
             return
         
+        # Enforce the plan's video length and resolution limits
+        plan = await plan_cache.get_plan(str(update.effective_user.id))
+        limit_error = check_video_limits(plan, video.duration, min(video.width, video.height))
+        if limit_error:
+            await update.message.reply_text(f"❌ {limit_error}")
+            return
+        
         # Clear any previous pending media to avoid confusion
+        context.user_data.pop('pending_album', None)
         if 'pending_photo' in context.user_data:
             del context.user_data['pending_photo']
         
         # Store video info for later processing
         context.user_data['pending_video'] = video.file_id
+        context.user_data['pending_unique_id'] = video.file_unique_id
         
         # Get current user settings
         user_id = str(update.effective_user.id)
-        db = get_db_session()
-        try:
-            user = db.query(User).filter(User.telegram_id == user_id).first()
-            if user:
-                settings = db.query(WatermarkSettings).filter(WatermarkSettings.user_id == user.id).first()
-                if not settings:
-                    settings = WatermarkSettings(user_id=user.id, **config.DEFAULT_WATERMARK_SETTINGS)
-                    db.add(settings)
-                    db.commit()
-            else:
-                # Create user if doesn't exist
-                await self.start_command(update, context)
-                return
-        finally:
-            db.close()
+        settings = await settings_cache.get_settings(user_id)
+        if not settings:
+            # Create user if doesn't exist
+            await self.start_command(update, context)
+            return
         
         # Show customization options (same as photo)
         keyboard = [
@@ -342,11 +421,11 @@ Choose an option below:
 🎬 **Video received!**
 
 **Current watermark settings:**
-📝 Text: `{settings.text}`
-📏 Font Size: `{settings.font_size}`
-📍 Position: `{settings.position.replace('_', ' ').title()}`
-🎨 Color: `{settings.color.title()}`
-👻 Opacity: `{settings.opacity}/255`
+📝 Text: `{settings['text']}`
+📏 Font Size: `{settings['font_size']}`
+📍 Position: `{settings['position'].replace('_', ' ').title()}`
+🎨 Color: `{settings['color'].title()}`
+👻 Opacity: `{settings['opacity']}/255`
 
 Choose an option below:
 """
@@ -363,64 +442,137 @@ Choose an option below:
             user_id = str(update.effective_user.id)
             new_text = update.message.text
             
-            db = get_db_session()
-            try:
-                user = db.query(User).filter(User.telegram_id == user_id).first()
-                if user:
-                    settings = db.query(WatermarkSettings).filter(WatermarkSettings.user_id == user.id).first()
-                    if settings:
-                        settings.text = new_text
-                        db.commit()
-                        
-                        # Show editing options after text update
-                        keyboard = []
-                        
-                        # If there's pending media, show apply option first
-                        if 'pending_photo' in context.user_data or 'pending_video' in context.user_data:
-                            keyboard.extend([
-                                [InlineKeyboardButton("✅ Apply Watermark", callback_data="apply_watermark")],
-                                [InlineKeyboardButton("📏 Font Size", callback_data="quick_font_size"),
-                                 InlineKeyboardButton("📍 Position", callback_data="quick_position")],
-                                [InlineKeyboardButton("🎨 Color", callback_data="quick_color"),
-                                 InlineKeyboardButton("👻 Opacity", callback_data="quick_opacity")],
-                                [InlineKeyboardButton("🔙 More Options", callback_data="back_to_media")]
-                            ])
-                        else:
-                            # No pending media, show general editing options
-                            keyboard.extend([
-                                [InlineKeyboardButton("📏 Font Size", callback_data="setting_font_size"),
-                                 InlineKeyboardButton("📍 Position", callback_data="setting_position")],
-                                [InlineKeyboardButton("🎨 Color", callback_data="setting_color"),
-                                 InlineKeyboardButton("👻 Opacity", callback_data="setting_opacity")],
-                                [InlineKeyboardButton("⚙️ All Settings", callback_data="settings_menu")]
-                            ])
-                        
-                        reply_markup = InlineKeyboardMarkup(keyboard)
-                        
-                        response_text = f"✅ Watermark text updated to: '{new_text}'\n\nWhat would you like to edit next?"
-                        
-                        await update.message.reply_text(
-                            response_text,
-                            reply_markup=reply_markup
-                        )
-                        del context.user_data['setting_text']
-            finally:
-                db.close()
+            settings = await settings_cache.update_settings(user_id, text=new_text)
+            if settings:
+                # Show editing options after text update
+                keyboard = []
+                
+                # If there's pending media, show apply option first
+                if any(key in context.user_data for key in ('pending_photo', 'pending_video', 'pending_album')):
+                    keyboard.extend([
+                        [InlineKeyboardButton("✅ Apply Watermark", callback_data="apply_watermark")],
+                        [InlineKeyboardButton("📏 Font Size", callback_data="quick_font_size"),
+                         InlineKeyboardButton("📍 Position", callback_data="quick_position")],
+                        [InlineKeyboardButton("🎨 Color", callback_data="quick_color"),
+                         InlineKeyboardButton("👻 Opacity", callback_data="quick_opacity")],
+                        [InlineKeyboardButton("🔙 More Options", callback_data="back_to_media")]
+                    ])
+                else:
+                    # No pending media, show general editing options
+                    keyboard.extend([
+                        [InlineKeyboardButton("📏 Font Size", callback_data="setting_font_size"),
+                         InlineKeyboardButton("📍 Position", callback_data="setting_position")],
+                        [InlineKeyboardButton("🎨 Color", callback_data="setting_color"),
+                         InlineKeyboardButton("👻 Opacity", callback_data="setting_opacity")],
+                        [InlineKeyboardButton("⚙️ All Settings", callback_data="settings_menu")]
+                    ])
+                
+                reply_markup = InlineKeyboardMarkup(keyboard)
+                
+                response_text = f"✅ Watermark text updated to: '{new_text}'\n\nWhat would you like to edit next?"
+                
+                await update.message.reply_text(
+                    response_text,
+                    reply_markup=reply_markup
+                )
+                del context.user_data['setting_text']
         else:
             await update.message.reply_text(
                 "👋 Send me a photo or video to add a watermark!\n"
                 "Use /help for more information."
             )
     
+    async def profile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /profile next [user_id] (admins only)."""
+        if update.effective_user.id not in config.ADMIN_USER_IDS:
+            return
+        
+        if not context.args or context.args[0] != "next" or len(context.args) > 2:
+            await update.message.reply_text("Usage: /profile next [user_id]")
+            return
+        
+        target = context.args[1] if len(context.args) == 2 else str(update.effective_user.id)
+        self.profile_requests[target] = update.effective_chat.id
+        await update.message.reply_text(
+            f"🔬 The next watermark request from user {target} will be profiled; "
+            "the report will be sent here."
+        )
+    
     async def handle_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle callback queries from inline keyboards."""
+        """Handle callback queries, profiling watermark requests when asked to."""
+        if update.callback_query.data in ("apply_watermark", "apply_watermark_full"):
+            user_id = str(update.effective_user.id)
+            report_chat_id = self.profile_requests.pop(user_id, None)
+            if report_chat_id is not None or self.profile_sampler.should_sample():
+                await self.profile_callback(update, context, report_chat_id)
+                return
+        await self.dispatch_callback(update, context)
+    
+    async def profile_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, report_chat_id: int = None):
+        """Run the callback under the profiler; send the report or save it to PROFILE_DIR."""
+        profiler = RequestProfiler()
+        if not profiler.start():
+            logger.info("Another request is being profiled; running unprofiled")
+            if report_chat_id is not None:
+                # Keep the admin's request for this user's next watermark
+                self.profile_requests.setdefault(str(update.effective_user.id), report_chat_id)
+            await self.dispatch_callback(update, context)
+            return
+        
+        start = time.perf_counter()
+        try:
+            job = await self.dispatch_callback(update, context)
+        except Exception:
+            profiler.stop()
+            raise
+        
+        # The render runs as a scheduled job; wait for it in a separate task
+        # so this handler returns and the user's next updates aren't held up
+        context.application.create_task(
+            self.finish_profile(update, context, profiler, start, job, report_chat_id),
+            update=update
+        )
+    
+    async def finish_profile(self, update: Update, context: ContextTypes.DEFAULT_TYPE, profiler: RequestProfiler,
+                             start: float, job=None, report_chat_id: int = None):
+        """Stop the profiler once the request's job is done and deliver the report."""
+        try:
+            if job is not None:
+                await asyncio.wait([job])
+        finally:
+            profiler.stop()
+        
+        elapsed = time.perf_counter() - start
+        user_id = str(update.effective_user.id)
+        try:
+            if report_chat_id is not None:
+                filename, report = profiler.report()
+                await context.bot.send_document(
+                    chat_id=report_chat_id,
+                    document=report,
+                    filename=filename,
+                    caption=f"🔬 Profile of user {user_id}'s request ({elapsed:.2f}s, {profiler.kind})"
+                )
+            else:
+                path = profiler.save(f"profile_{int(time.time())}_{user_id}")
+                logger.info(f"Saved sampled profile ({elapsed:.2f}s) to {path}")
+        except Exception as e:
+            logger.error(f"Could not deliver profile: {e}")
+    
+    async def dispatch_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle callback queries from inline keyboards.
+        
+        Returns the scheduled job's future when the callback queued one.
+        """
         query = update.callback_query
         await query.answer()
         
         data = query.data
         
         if data == "apply_watermark":
-            await self.process_pending_media(update, context)
+            return await self.process_pending_media(update, context)
+        elif data == "apply_watermark_full":
+            return await self.process_pending_media(update, context, full_resolution=True)
         elif data in ["quick_text", "quick_size", "quick_font_size", "quick_position", "quick_color", "quick_opacity"]:
             await self.handle_quick_setting(update, context, data)
         elif data == "done_editing":
@@ -530,41 +682,33 @@ Choose an option below:
         elif menu_action == "current":
             user_id = str(update.effective_user.id)
             
-            db = get_db_session()
-            try:
-                user = db.query(User).filter(User.telegram_id == user_id).first()
-                if not user:
-                    return
-                
-                settings = db.query(WatermarkSettings).filter(WatermarkSettings.user_id == user.id).first()
-                if not settings:
-                    return
-                
-                settings_text = f"""
+            settings = await settings_cache.get_settings(user_id)
+            if not settings:
+                return
+            
+            settings_text = f"""
 📊 **Current Watermark Settings**
 
-📝 **Text:** `{settings.text}`
-📏 **Font Size:** `{settings.font_size}px`
-👻 **Opacity:** `{int((settings.opacity/255)*100)}%` (transparency)
-📍 **Position:** `{settings.position.replace('_', ' ').title()}`
-🎨 **Color:** `{settings.color.title()}`
+📝 **Text:** `{settings['text']}`
+📏 **Font Size:** `{settings['font_size']}px`
+👻 **Opacity:** `{int((settings['opacity']/255)*100)}%` (transparency)
+📍 **Position:** `{settings['position'].replace('_', ' ').title()}`
+🎨 **Color:** `{settings['color'].title()}`
 
 Send a photo or video to apply these settings!
 """
-                
-                keyboard = [
-                    [InlineKeyboardButton("⚙️ Change Settings", callback_data="menu_settings")],
-                    [InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_main_menu")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await update.callback_query.edit_message_text(
-                    settings_text,
-                    reply_markup=reply_markup,
-                    parse_mode=ParseMode.MARKDOWN
-                )
-            finally:
-                db.close()
+            
+            keyboard = [
+                [InlineKeyboardButton("⚙️ Change Settings", callback_data="menu_settings")],
+                [InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_main_menu")]
+            ]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            
+            await update.callback_query.edit_message_text(
+                settings_text,
+                reply_markup=reply_markup,
+                parse_mode=ParseMode.MARKDOWN
+            )
         
         elif menu_action == "help":
             help_text = """
@@ -620,17 +764,9 @@ Send a photo or video to apply these settings!
         user_id = str(update.effective_user.id)
         
         # Get current user settings
-        db = get_db_session()
-        try:
-            user = db.query(User).filter(User.telegram_id == user_id).first()
-            if not user:
-                return
-            
-            settings = db.query(WatermarkSettings).filter(WatermarkSettings.user_id == user.id).first()
-            if not settings:
-                return
-        finally:
-            db.close()
+        settings = await settings_cache.get_settings(user_id)
+        if not settings:
+            return
         
         keyboard = [
             [
@@ -651,11 +787,11 @@ Send a photo or video to apply these settings!
 🎯 **Watermark Bot Main Menu**
 
 **Current Settings Preview:**
-📝 Text: `{settings.text}`
-📏 Size: `{settings.font_size}px`
-👻 Opacity: `{int((settings.opacity/255)*100)}%`
-📍 Position: `{settings.position.replace('_', ' ').title()}`
-🎨 Color: `{settings.color.title()}`
+📝 Text: `{settings['text']}`
+📏 Size: `{settings['font_size']}px`
+👻 Opacity: `{int((settings['opacity']/255)*100)}%`
+📍 Position: `{settings['position'].replace('_', ' ').title()}`
+🎨 Color: `{settings['color'].title()}`
 
 Choose an option below or send a photo/video to start:
 """
@@ -730,119 +866,410 @@ Choose an option below or send a photo/video to start:
                 reply_markup=reply_markup
             )
     
-    async def process_pending_media(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Process the pending photo or video with current settings."""
-        if 'pending_photo' in context.user_data:
-            await self.process_photo_with_settings(update, context, context.user_data['pending_photo'])
+    async def process_pending_media(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                    full_resolution: bool = False):
+        """Process the pending photo or video with current settings.
+        
+        full_resolution sends a single photo as an unscaled document instead
+        of a photo rendered at delivery size. Returns the queued job's
+        future, or None if nothing was queued.
+        """
+        if 'pending_album' in context.user_data:
+            return await self.process_album_with_settings(update, context, context.user_data['pending_album'])
+        elif 'pending_photo' in context.user_data:
+            return await self.process_photo_with_settings(update, context, context.user_data['pending_photo'],
+                                                          full_resolution)
         elif 'pending_video' in context.user_data:
-            await self.process_video_with_settings(update, context, context.user_data['pending_video'])
+            return await self.process_video_with_settings(update, context, context.user_data['pending_video'])
         else:
             await update.callback_query.edit_message_text(
                 "❌ No pending media found. Please send a new photo or video."
             )
     
-    async def process_photo_with_settings(self, update: Update, context: ContextTypes.DEFAULT_TYPE, file_id: str):
+    async def process_photo_with_settings(self, update: Update, context: ContextTypes.DEFAULT_TYPE, file_id: str,
+                                          full_resolution: bool = False):
         """Process photo with current watermark settings."""
         await update.callback_query.edit_message_text("🔄 Processing your image...")
         
         try:
-            file = await context.bot.get_file(file_id)
-            
-            # Download file
-            file_path = f"temp/{file_id}.jpg"
-            await file.download_to_drive(file_path)
-            
-            # Process image
             user_id = str(update.effective_user.id)
-            processed_path = await self.media_processor.process_image(file_path, user_id)
+            settings = await self.media_processor.get_user_settings(user_id)
+            unique_id = context.user_data.get('pending_unique_id')
+            plan = await plan_cache.get_plan(user_id)
+            if not await self.check_daily_quota(update, user_id, plan):
+                return
             
-            # Send processed image with edit options
-            keyboard = [
-                [
-                    InlineKeyboardButton("✏️ Edit Text", callback_data="quick_text"),
-                    InlineKeyboardButton("🔧 Font Size", callback_data="quick_size")
-                ],
-                [
-                    InlineKeyboardButton("🎨 Color", callback_data="quick_color"),
-                    InlineKeyboardButton("📍 Position", callback_data="quick_position")
-                ],
-                [
-                    InlineKeyboardButton("💫 Opacity", callback_data="quick_opacity"),
-                    InlineKeyboardButton("✅ Done", callback_data="done_editing")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            # Queue the render and return so this user's next updates aren't
+            # held up behind it; repeated taps join the job already queued
+            with log_context(user_id, unique_id):
+                job = self.scheduler.enqueue(
+                    user_id,
+                    "image",
+                    lambda: self.run_job(
+                        update, "photo", "❌ Sorry, there was an error processing your image. Please try again.",
+                        lambda: self.send_watermarked_photo(update, context, file_id, unique_id, settings,
+                                                            full_resolution)
+                    ),
+                    key=("photo", user_id, file_id, settings_fingerprint(settings), full_resolution),
+                    plan=plan,
+                    on_position=lambda position: self.show_queue_position(update, position, "🔄 Processing your image...")
+                )
+                self.usage.reserve(user_id, 1, job)
+                return job
             
-            with open(processed_path, 'rb') as f:
-                await update.callback_query.message.reply_photo(
-                    photo=f,
+        except Exception as e:
+            logger.error(f"Error processing image: {e}")
+            ERRORS.inc(kind="photo")
+            await update.callback_query.edit_message_text(
+                "❌ Sorry, there was an error processing your image. Please try again."
+            )
+    
+    async def send_watermarked_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE, file_id: str,
+                                     unique_id: str, settings: dict, full_resolution: bool = False):
+        """Render and send the watermarked photo; runs as a scheduled job."""
+        user_id = str(update.effective_user.id)
+        
+        # Same photo with the same settings: re-send the earlier output
+        cache_key = self.result_cache.make_key('photo_full' if full_resolution else 'photo', unique_id, settings)
+        photo = self.result_cache.get(cache_key)
+        if photo is None:
+            # Download and process image
+            photo = await self.render_photo(context, file_id, unique_id, user_id, settings, full_resolution)
+            JOBS.inc(kind="photo", outcome="rendered")
+        else:
+            JOBS.inc(kind="photo", outcome="cached")
+        
+        # Send processed image with edit options
+        keyboard = [
+            [
+                InlineKeyboardButton("✏️ Edit Text", callback_data="quick_text"),
+                InlineKeyboardButton("🔧 Font Size", callback_data="quick_size")
+            ],
+            [
+                InlineKeyboardButton("🎨 Color", callback_data="quick_color"),
+                InlineKeyboardButton("📍 Position", callback_data="quick_position")
+            ],
+            [
+                InlineKeyboardButton("💫 Opacity", callback_data="quick_opacity"),
+                InlineKeyboardButton("✅ Done", callback_data="done_editing")
+            ]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        with stage_timer("upload"):
+            if full_resolution:
+                # Documents skip Telegram's photo recompression
+                message = await update.callback_query.message.reply_document(
+                    document=photo,
+                    filename="watermarked.jpg",
                     caption="✅ Watermark applied successfully!\n\n🔧 Need adjustments? Use the buttons below to make quick changes:",
                     reply_markup=reply_markup
                 )
+            else:
+                message = await update.callback_query.message.reply_photo(
+                    photo=photo,
+                    caption="✅ Watermark applied successfully!\n\n🔧 Need adjustments? Use the buttons below to make quick changes:",
+                    reply_markup=reply_markup
+                )
+        if message.document:
+            self.result_cache.put(cache_key, message.document.file_id)
+        elif message.photo:
+            self.result_cache.put(cache_key, message.photo[-1].file_id)
+        self.usage.record(user_id, "image", len(photo) if isinstance(photo, bytes) else None)
+        
+        # Keep media for quick edits instead of clearing
+        # del context.user_data['pending_photo']
+    
+    async def render_photo(self, context: ContextTypes.DEFAULT_TYPE, file_id: str, unique_id: str,
+                           user_id: str, settings: dict = None, full_resolution: bool = False) -> bytes:
+        """Download and watermark a photo, returning the encoded result.
+        
+        Photos up to IN_MEMORY_MEDIA_LIMIT bytes never touch the disk and are
+        kept in the source cache for quick edits; larger ones go through temp
+        files that are removed even if processing fails. Unless
+        full_resolution is set, the photo is rendered at PHOTO_MAX_SIDE.
+        """
+        data = self.source_cache.get_bytes(user_id, unique_id)
+        if data is not None:
+            return await self.media_processor.process_image_bytes(data, user_id, settings, full_resolution)
+        
+        with stage_timer("get_file"):
+            file = await context.bot.get_file(file_id)
+        if file.file_size and file.file_size <= config.IN_MEMORY_MEDIA_LIMIT:
+            with stage_timer("download"):
+                data = bytes(await file.download_as_bytearray())
+            self.source_cache.put_bytes(user_id, unique_id, data)
+            return await self.media_processor.process_image_bytes(data, user_id, settings, full_resolution)
+        
+        file_path = f"{config.TEMP_DIR}/{user_id}_{file_id}.jpg"
+        processed_path = None
+        try:
+            with stage_timer("download"):
+                await file.download_to_drive(file_path)
+            processed_path = await self.media_processor.process_image(file_path, user_id, settings, full_resolution)
+            with open(processed_path, 'rb') as f:
+                return f.read()
+        finally:
+            for path in (file_path, processed_path):
+                if path and os.path.exists(path):
+                    os.remove(path)
+    
+    async def process_album_with_settings(self, update: Update, context: ContextTypes.DEFAULT_TYPE, items: list):
+        """Process every photo of the pending album with current watermark settings."""
+        await update.callback_query.edit_message_text(f"🔄 Processing your {len(items)} images...")
+        
+        try:
+            user_id = str(update.effective_user.id)
+            settings = await self.media_processor.get_user_settings(user_id)
+            plan = await plan_cache.get_plan(user_id)
+            if not await self.check_daily_quota(update, user_id, plan, len(items)):
+                return
             
-            # Clean up
-            os.remove(file_path)
-            os.remove(processed_path)
-            
-            # Keep media for quick edits instead of clearing
-            # del context.user_data['pending_photo']
+            # The whole album is one job in the image lane
+            with log_context(user_id):
+                job = self.scheduler.enqueue(
+                    user_id,
+                    "image",
+                    lambda: self.run_job(
+                        update, "album", "❌ Sorry, there was an error processing your images. Please try again.",
+                        lambda: self.send_watermarked_album(update, context, items, settings)
+                    ),
+                    key=("album", user_id, tuple(file_id for file_id, _ in items), settings_fingerprint(settings)),
+                    plan=plan,
+                    on_position=lambda position: self.show_queue_position(
+                        update, position, f"🔄 Processing your {len(items)} images..."
+                    )
+                )
+                self.usage.reserve(user_id, len(items), job)
+                return job
             
         except Exception as e:
-            logger.error(f"Error processing image: {e}")
+            logger.error(f"Error processing album: {e}")
+            ERRORS.inc(kind="album")
             await update.callback_query.edit_message_text(
-                "❌ Sorry, there was an error processing your image. Please try again."
+                "❌ Sorry, there was an error processing your images. Please try again."
             )
     
+    async def send_watermarked_album(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                     items: list, settings: dict):
+        """Render all album photos concurrently and send them as media groups."""
+        user_id = str(update.effective_user.id)
+        
+        async def render(file_id: str, unique_id: str):
+            cached_file_id = self.result_cache.get(self.result_cache.make_key('photo', unique_id, settings))
+            if cached_file_id is not None:
+                JOBS.inc(kind="photo", outcome="cached")
+                return cached_file_id
+            photo = await self.render_photo(context, file_id, unique_id, user_id, settings)
+            JOBS.inc(kind="photo", outcome="rendered")
+            return photo
+        
+        photos = await asyncio.gather(*[render(file_id, unique_id) for file_id, unique_id in items])
+        
+        # Telegram allows up to 10 items per media group
+        for start in range(0, len(photos), 10):
+            chunk = photos[start:start + 10]
+            with stage_timer("upload"):
+                messages = await update.callback_query.message.reply_media_group(
+                    media=[InputMediaPhoto(media=photo) for photo in chunk]
+                )
+            for (_, unique_id), photo, message in zip(items[start:start + 10], chunk, messages):
+                if message.photo:
+                    self.result_cache.put(
+                        self.result_cache.make_key('photo', unique_id, settings), message.photo[-1].file_id
+                    )
+                self.usage.record(user_id, "image", len(photo) if isinstance(photo, bytes) else None)
+        
+        # Media groups can't carry buttons, so offer the edit options separately
+        keyboard = [
+            [
+                InlineKeyboardButton("✏️ Edit Text", callback_data="quick_text"),
+                InlineKeyboardButton("🔧 Font Size", callback_data="quick_size")
+            ],
+            [
+                InlineKeyboardButton("🎨 Color", callback_data="quick_color"),
+                InlineKeyboardButton("📍 Position", callback_data="quick_position")
+            ],
+            [
+                InlineKeyboardButton("💫 Opacity", callback_data="quick_opacity"),
+                InlineKeyboardButton("✅ Done", callback_data="done_editing")
+            ]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await update.callback_query.message.reply_text(
+            "✅ Watermark applied successfully!\n\n🔧 Need adjustments? Use the buttons below to make quick changes:",
+            reply_markup=reply_markup
+        )
+    
     async def process_video_with_settings(self, update: Update, context: ContextTypes.DEFAULT_TYPE, file_id: str):
         """Process video with current watermark settings."""
         await update.callback_query.edit_message_text("🔄 Processing your video... This may take a while.")
         
         try:
-            file = await context.bot.get_file(file_id)
-            
-            # Download file
-            file_path = f"temp/{file_id}.mp4"
-            await file.download_to_drive(file_path)
-            
-            # Process video
             user_id = str(update.effective_user.id)
-            processed_path = await self.media_processor.process_video(file_path, user_id)
+            settings = await self.media_processor.get_user_settings(user_id)
+            unique_id = context.user_data.get('pending_unique_id')
+            plan = await plan_cache.get_plan(user_id)
+            if not await self.check_daily_quota(update, user_id, plan):
+                return
             
-            # Send processed video with edit options
-            keyboard = [
-                [
-                    InlineKeyboardButton("✏️ Edit Text", callback_data="quick_text"),
-                    InlineKeyboardButton("🔧 Font Size", callback_data="quick_size")
-                ],
-                [
-                    InlineKeyboardButton("🎨 Color", callback_data="quick_color"),
-                    InlineKeyboardButton("📍 Position", callback_data="quick_position")
-                ],
-                [
-                    InlineKeyboardButton("💫 Opacity", callback_data="quick_opacity"),
-                    InlineKeyboardButton("✅ Done", callback_data="done_editing")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            # Queue the render and return so this user's next updates aren't
+            # held up behind it; repeated taps join the job already queued
+            with log_context(user_id, unique_id):
+                job = self.scheduler.enqueue(
+                    user_id,
+                    "video",
+                    lambda: self.run_job(
+                        update, "video", "❌ Sorry, there was an error processing your video. Please try again.",
+                        lambda: self.send_watermarked_video(update, context, file_id, unique_id, settings)
+                    ),
+                    key=("video", user_id, file_id, settings_fingerprint(settings)),
+                    plan=plan,
+                    on_position=lambda position: self.show_queue_position(update, position, "🔄 Processing your video... This may take a while.")
+                )
+                self.usage.reserve(user_id, 1, job)
+                return job
             
-            with open(processed_path, 'rb') as f:
+        except Exception as e:
+            logger.error(f"Error processing video: {e}")
+            ERRORS.inc(kind="video")
+            await update.callback_query.edit_message_text(
+                "❌ Sorry, there was an error processing your video. Please try again."
+            )
+    
+    async def send_watermarked_video(self, update: Update, context: ContextTypes.DEFAULT_TYPE, file_id: str,
+                                     unique_id: str, settings: dict):
+        """Render and send the watermarked video; runs as a scheduled job."""
+        user_id = str(update.effective_user.id)
+        
+        # Send processed video with edit options
+        keyboard = [
+            [
+                InlineKeyboardButton("✏️ Edit Text", callback_data="quick_text"),
+                InlineKeyboardButton("🔧 Font Size", callback_data="quick_size")
+            ],
+            [
+                InlineKeyboardButton("🎨 Color", callback_data="quick_color"),
+                InlineKeyboardButton("📍 Position", callback_data="quick_position")
+            ],
+            [
+                InlineKeyboardButton("💫 Opacity", callback_data="quick_opacity"),
+                InlineKeyboardButton("✅ Done", callback_data="done_editing")
+            ]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        # Same video with the same settings: re-send the earlier output
+        cache_key = self.result_cache.make_key('video', unique_id, settings)
+        cached_file_id = self.result_cache.get(cache_key)
+        if cached_file_id is not None:
+            with stage_timer("upload"):
                 await update.callback_query.message.reply_video(
-                    video=f,
+                    video=cached_file_id,
                     caption="✅ Watermark applied successfully!\n\n🔧 Need adjustments? Use the buttons below to make quick changes:",
                     reply_markup=reply_markup
                 )
+            JOBS.inc(kind="video", outcome="cached")
+            self.usage.record(user_id, "video")
+            return
+        
+        # Reuse the video downloaded for an earlier render when possible
+        file_path = self.source_cache.acquire_video(user_id, unique_id)
+        leased = file_path is not None
+        if not leased:
+            with stage_timer("get_file"):
+                file = await context.bot.get_file(file_id)
             
-            # Clean up
-            os.remove(file_path)
-            os.remove(processed_path)
-            
-            # Keep media for quick edits instead of clearing
-            # del context.user_data['pending_video']
+            # Download file
+            file_path = f"{config.TEMP_DIR}/{user_id}_{file_id}.mp4"
+            with stage_timer("download"):
+                await file.download_to_drive(file_path)
+            leased = self.source_cache.put_video(user_id, unique_id, file_path)
+        
+        processed_path = None
+        try:
+            # Process video
+            processed_path = await self.media_processor.process_video(file_path, user_id, settings)
             
+            with open(processed_path, 'rb') as f, stage_timer("upload"):
+                message = await update.callback_query.message.reply_video(
+                    video=f,
+                    caption="✅ Watermark applied successfully!\n\n🔧 Need adjustments? Use the buttons below to make quick changes:",
+                    reply_markup=reply_markup
+                )
+            JOBS.inc(kind="video", outcome="rendered")
+            if message.video:
+                self.result_cache.put(cache_key, message.video.file_id)
+            self.usage.record(user_id, "video", os.path.getsize(processed_path))
+        finally:
+            # Clean up; a cached source stays on disk for quick edits
+            if leased:
+                self.source_cache.release_video(file_path)
+            elif os.path.exists(file_path):
+                os.remove(file_path)
+            if processed_path and os.path.exists(processed_path):
+                os.remove(processed_path)
+        
+        # Keep media for quick edits instead of clearing
+        # del context.user_data['pending_video']
+    
+    async def run_job(self, update: Update, kind: str, error_text: str, job):
+        """Run a scheduled job, telling the user if it fails."""
+        try:
+            await job()
         except Exception as e:
-            logger.error(f"Error processing video: {e}")
+            logger.error(f"Error processing {kind}: {e}")
+            ERRORS.inc(kind=kind)
+            await update.callback_query.edit_message_text(error_text)
+    
+    def collect_metrics(self) -> list:
+        """Cache and queue gauges for the metrics endpoint."""
+        samples = []
+        for cache_name, stats in (('result', self.result_cache.stats()),
+                                  ('source', self.source_cache.stats()),
+                                  ('settings', settings_cache.stats()),
+                                  ('stamp', self.render_pool.stamp_cache_stats())):
+            for field, value in stats.items():
+                samples.append((f"watermark_cache_{field}", {'cache': cache_name}, value))
+        for lane, depth in self.scheduler.queue_depth().items():
+            samples.append(("watermark_queue_queued", {'lane': lane}, depth['queued']))
+            samples.append(("watermark_queue_running", {'lane': lane}, depth['running']))
+        samples.append(("watermark_queue_deduplicated", {}, self.scheduler.deduplicated))
+        samples.append(("watermark_usage_flushed", {}, self.usage.flushed))
+        return samples
+    
+    async def check_daily_quota(self, update: Update, user_id: str, plan: str, count: int = 1) -> bool:
+        """Tell the user and return False if today's plan quota can't cover count more files."""
+        daily_limit = plan_policy(plan)['daily_limit']
+        if not daily_limit:
+            return True
+        
+        # Files of jobs still queued or running count too
+        used = await self.usage.get_daily_count(user_id) + self.usage.reserved(user_id)
+        if used + count <= daily_limit:
+            return True
+        
+        remaining = max(0, daily_limit - used)
+        if remaining and count > 1:
             await update.callback_query.edit_message_text(
-                "❌ Sorry, there was an error processing your video. Please try again."
+                f"❌ This album has {count} photos, but only {remaining} of today's {daily_limit} files "
+                f"on the {plan} plan are left. Please send fewer photos or try again tomorrow."
+            )
+        else:
+            await update.callback_query.edit_message_text(
+                f"❌ You've reached today's limit of {daily_limit} files on the {plan} plan. "
+                "Please try again tomorrow."
+            )
+        return False
+    
+    async def show_queue_position(self, update: Update, position: int, processing_text: str):
+        """Edit the processing message with the job's place in the queue."""
+        if position == 0:
+            await update.callback_query.edit_message_text(processing_text)
+        else:
+            await update.callback_query.edit_message_text(
+                f"⏳ Waiting in queue... You are number {position}."
             )
     
     async def show_apply_option(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -862,68 +1289,48 @@ Choose an option below or send a photo/video to start:
         """Update a specific setting based on callback data."""
         user_id = str(update.effective_user.id)
         
-        db = get_db_session()
-        try:
-            user = db.query(User).filter(User.telegram_id == user_id).first()
-            if not user:
-                return
-            
-            settings = db.query(WatermarkSettings).filter(WatermarkSettings.user_id == user.id).first()
-            if not settings:
-                return
-            
-            message = ""
-            if data.startswith("fontsize_"):
-                font_size = int(data.split("_")[1])
-                settings.font_size = font_size
-                message = f"✅ Font size updated to: {font_size}"
-            elif data.startswith("opacity_"):
-                opacity = int(data.split("_")[1])
-                settings.opacity = opacity
-                message = f"✅ Opacity updated to: {opacity}/255"
-            elif data.startswith("position_"):
-                position = data.replace("position_", "")
-                settings.position = position
-                message = f"✅ Position updated to: {position.replace('_', ' ')}"
-            elif data.startswith("color_"):
-                color = data.split("_")[1]
-                settings.color = color
-                message = f"✅ Color updated to: {color}"
-            
-            db.commit()
-            
-            # Show updated setting and option to reprocess
-            keyboard = [
-                [InlineKeyboardButton("🔄 Apply Changes", callback_data="reprocess_last")],
-                [InlineKeyboardButton("✅ Done", callback_data="done_editing")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await update.callback_query.edit_message_text(
-                f"{message}\n\n🔄 Want to see the changes? Apply them to your last image/video:",
-                reply_markup=reply_markup
-            )
-            
-        finally:
-            db.close()
+        changes = {}
+        message = ""
+        if data.startswith("fontsize_"):
+            font_size = int(data.split("_")[1])
+            changes['font_size'] = font_size
+            message = f"✅ Font size updated to: {font_size}"
+        elif data.startswith("opacity_"):
+            opacity = int(data.split("_")[1])
+            changes['opacity'] = opacity
+            message = f"✅ Opacity updated to: {opacity}/255"
+        elif data.startswith("position_"):
+            position = data.replace("position_", "")
+            changes['position'] = position
+            message = f"✅ Position updated to: {position.replace('_', ' ')}"
+        elif data.startswith("color_"):
+            color = data.split("_")[1]
+            changes['color'] = color
+            message = f"✅ Color updated to: {color}"
+        
+        settings = await settings_cache.update_settings(user_id, **changes)
+        if not settings:
+            return
+        
+        # Show updated setting and option to reprocess
+        keyboard = [
+            [InlineKeyboardButton("🔄 Apply Changes", callback_data="reprocess_last")],
+            [InlineKeyboardButton("✅ Done", callback_data="done_editing")]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await update.callback_query.edit_message_text(
+            f"{message}\n\n🔄 Want to see the changes? Apply them to your last image/video:",
+            reply_markup=reply_markup
+        )
     
     async def show_media_options(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show media customization options again."""
         user_id = str(update.effective_user.id)
         
-        db = get_db_session()
-        try:
-            user = db.query(User).filter(User.telegram_id == user_id).first()
-            if user:
-                settings = db.query(WatermarkSettings).filter(WatermarkSettings.user_id == user.id).first()
-                if not settings:
-                    settings = WatermarkSettings(user_id=user.id, **config.DEFAULT_WATERMARK_SETTINGS)
-                    db.add(settings)
-                    db.commit()
-            else:
-                return
-        finally:
-            db.close()
+        settings = await settings_cache.get_settings(user_id)
+        if not settings:
+            return
         
         # Show customization options
         keyboard = [
@@ -943,19 +1350,27 @@ Choose an option below or send a photo/video to start:
                 InlineKeyboardButton("⚙️ Advanced Settings", callback_data="settings_menu")
             ]
         ]
+        if 'pending_photo' in context.user_data and 'pending_album' not in context.user_data:
+            # Single photos can also be sent uncompressed as a document
+            keyboard[-1].insert(0, InlineKeyboardButton("📄 Full Resolution", callback_data="apply_watermark_full"))
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        media_type = "📸 Image" if 'pending_photo' in context.user_data else "🎬 Video"
+        if 'pending_album' in context.user_data:
+            media_type = f"🖼 Album of {len(context.user_data['pending_album'])} photos"
+        elif 'pending_photo' in context.user_data:
+            media_type = "📸 Image"
+        else:
+            media_type = "🎬 Video"
         
         preview_text = f"""
 {media_type} ready for processing!
 
 **Current watermark settings:**
-📝 Text: `{settings.text}`
-📏 Font Size: `{settings.font_size}`
-📍 Position: `{settings.position.replace('_', ' ').title()}`
-🎨 Color: `{settings.color.title()}`
-👻 Opacity: `{settings.opacity}/255`
+📝 Text: `{settings['text']}`
+📏 Font Size: `{settings['font_size']}`
+📍 Position: `{settings['position'].replace('_', ' ').title()}`
+🎨 Color: `{settings['color'].title()}`
+👻 Opacity: `{settings['opacity']}/255`
 
 Choose an option below:
 """
@@ -0,0 +1,145 @@
+import logging
+import os
+import time
+from collections import Counter, OrderedDict
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class SourceEntry:
+    def __init__(self, unique_id: str, data: bytes = None, path: str = None, size: int = 0):
+        self.unique_id = unique_id
+        self.data = data
+        self.path = path
+        self.size = size
+        self.expires = time.monotonic() + config.SOURCE_CACHE_TTL
+
+
+class SourceCache:
+    """Short-lived cache of each user's last downloaded source media.
+
+    Quick edits re-render the same photo or video with new settings; keeping
+    the source avoids a get_file + download round trip per iteration. Photos
+    are kept as their encoded bytes (decoding is cheap next to shipping a
+    decoded bitmap to a render process), videos as the downloaded file.
+    There is one entry per user; the photo bytes and video files each have
+    a global budget, and the least recently used entries go first.
+
+    Video files handed out by acquire_video() stay on disk until
+    release_video() is called, even if their entry is evicted meanwhile.
+    """
+
+    def __init__(self, max_bytes: int = None, max_disk_bytes: int = None):
+        self.max_bytes = config.SOURCE_CACHE_BYTES if max_bytes is None else max_bytes
+        self.max_disk_bytes = config.SOURCE_CACHE_DISK_BYTES if max_disk_bytes is None else max_disk_bytes
+        self._entries = OrderedDict()
+        self._leases = Counter()
+        self._orphans = set()
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_bytes(self, user_id: str, unique_id: str) -> bytes:
+        """Return the cached photo bytes, or None."""
+        entry = self._lookup(user_id, unique_id)
+        if entry is None or entry.data is None:
+            return None
+        return entry.data
+
+    def put_bytes(self, user_id: str, unique_id: str, data: bytes):
+        if not unique_id or len(data) > self.max_bytes:
+            return
+        self._insert(user_id, SourceEntry(unique_id, data=data, size=len(data)))
+
+    def acquire_video(self, user_id: str, unique_id: str) -> str:
+        """Return a leased path to the cached video, or None."""
+        entry = self._lookup(user_id, unique_id)
+        if entry is None or entry.path is None:
+            return None
+        self._leases[entry.path] += 1
+        return entry.path
+
+    def put_video(self, user_id: str, unique_id: str, path: str) -> bool:
+        """Hand a downloaded video to the cache.
+
+        Returns True if the cache took the file; the caller then holds a
+        lease and must call release_video(path). On False the caller still
+        owns the file.
+        """
+        size = os.path.getsize(path)
+        if not unique_id or size > self.max_disk_bytes:
+            return False
+        self._insert(user_id, SourceEntry(unique_id, path=path, size=size))
+        self._leases[path] += 1
+        return True
+
+    def release_video(self, path: str):
+        self._leases[path] -= 1
+        if self._leases[path] <= 0:
+            del self._leases[path]
+            if path in self._orphans:
+                self._orphans.discard(path)
+                self._remove_file(path)
+
+    def purge_expired(self):
+        now = time.monotonic()
+        for user_id in [u for u, e in self._entries.items() if e.expires <= now]:
+            self._discard(self._entries.pop(user_id))
+
+    def clear(self):
+        """Drop every entry and delete cached video files."""
+        while self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._discard(entry)
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self._entries),
+            'memory_bytes': self.memory_bytes,
+            'disk_bytes': self.disk_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def _lookup(self, user_id: str, unique_id: str) -> SourceEntry:
+        self.purge_expired()
+        entry = self._entries.get(user_id)
+        if entry is None or not unique_id or entry.unique_id != unique_id:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return entry
+
+    def _insert(self, user_id: str, entry: SourceEntry):
+        self.purge_expired()
+        old = self._entries.pop(user_id, None)
+        if old is not None:
+            self._discard(old)
+        self._entries[user_id] = entry
+        if entry.path is not None:
+            self.disk_bytes += entry.size
+        else:
+            self.memory_bytes += entry.size
+        while self.memory_bytes > self.max_bytes or self.disk_bytes > self.max_disk_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._discard(evicted)
+
+    def _discard(self, entry: SourceEntry):
+        if entry.path is None:
+            self.memory_bytes -= entry.size
+            return
+        self.disk_bytes -= entry.size
+        if self._leases[entry.path] > 0:
+            self._orphans.add(entry.path)
+        else:
+            self._leases.pop(entry.path, None)
+            self._remove_file(entry.path)
+
+    def _remove_file(self, path: str):
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"Could not remove cached video {path}: {e}")
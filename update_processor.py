@@ -0,0 +1,78 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from logging_setup import log_context
+import config
+
+logger = logging.getLogger(__name__)
+
+
+def update_user_key(update: object):
+    """The user an update belongs to, or None for updates without one."""
+    if isinstance(update, Update) and update.effective_user is not None:
+        return update.effective_user.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates concurrently while keeping each user's in order.
+
+    Handlers keep per-user conversation state in context.user_data
+    (pending_photo, setting_text, ...), so two updates from the same user
+    must not interleave. Updates from different users run in parallel up to
+    max_concurrent_updates. A user's update waits for their previous one
+    before it takes a concurrency slot, so one busy user can't fill every
+    slot with waiting updates.
+
+    The lock is held for the whole handler, so handlers must not await
+    long work: renders are queued with JobScheduler.enqueue() and run
+    outside it, which lets the user keep tapping buttons meanwhile.
+    Background tasks that change a user's conversation state take the same
+    lock with user_lock().
+    """
+
+    def __init__(self, max_concurrent_updates: int = None):
+        super().__init__(max_concurrent_updates or config.CONCURRENT_UPDATES)
+        self._locks = {}
+        self._waiting = {}
+
+    async def process_update(self, update: object, coroutine) -> None:
+        key = update_user_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        async with self.user_lock(key):
+            with log_context(user_id=key):
+                await super().process_update(update, coroutine)
+
+    @asynccontextmanager
+    async def user_lock(self, key):
+        """Hold a user's lock, waiting for their update in progress to finish."""
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._waiting[key] = self._waiting.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._waiting[key] -= 1
+            if self._waiting[key] == 0:
+                del self._waiting[key]
+                del self._locks[key]
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {
+            'users': len(self._locks),
+            'pending': sum(self._waiting.values()),
+        }
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+from database import get_async_session
+from models import count_usage_since, get_user_ids, insert_usage
+import config
+
+logger = logging.getLogger(__name__)
+
+
+def utc_now() -> datetime:
+    """Naive UTC timestamp, as stored in Usage.processed_at."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class UsageRecorder:
+    """Buffers usage events and writes them to the Usage table in bulk.
+
+    record() only appends to memory. The buffer is flushed with one bulk
+    INSERT every USAGE_FLUSH_INTERVAL seconds, as soon as it holds
+    USAGE_BATCH_SIZE events, and on shutdown. Per-user counts for the
+    current day are cached for quota checks and kept up to date by record().
+
+    Quotas are checked when a job is queued, but record() only runs once its
+    result is delivered, so queued jobs reserve() their files until they
+    finish; otherwise every job queued meanwhile would pass the check.
+    """
+
+    def __init__(self, batch_size: int = None, flush_interval: float = None):
+        self.batch_size = batch_size or config.USAGE_BATCH_SIZE
+        self.flush_interval = flush_interval or config.USAGE_FLUSH_INTERVAL
+        self._buffer = []
+        self._daily_counts = OrderedDict()
+        self._reserved = Counter()
+        self._reservations = {}
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self.flushed = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._flush_periodically())
+
+    async def stop(self):
+        """Stop the periodic flush and write everything still buffered."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def record(self, telegram_id: str, media_type: str, file_size: int = None):
+        now = utc_now()
+        self._buffer.append({
+            'telegram_id': telegram_id,
+            'media_type': media_type,
+            'file_size': file_size,
+            'processed_at': now,
+        })
+        key = (telegram_id, now.date())
+        if key in self._daily_counts:
+            self._daily_counts[key] += 1
+        if len(self._buffer) >= self.batch_size:
+            asyncio.ensure_future(self.flush())
+
+    def reserve(self, telegram_id: str, count: int, future: asyncio.Future):
+        """Hold count files of the user's quota until future is done.
+
+        A future that already holds a reservation (a deduplicated job) is
+        ignored. Delivered files are counted by record() before the job ends.
+        """
+        if future in self._reservations:
+            return
+        self._reservations[future] = (telegram_id, count)
+        self._reserved[telegram_id] += count
+        future.add_done_callback(self._release)
+
+    def reserved(self, telegram_id: str) -> int:
+        """Files held by the user's queued and running jobs."""
+        return self._reserved.get(telegram_id, 0)
+
+    def _release(self, future: asyncio.Future):
+        telegram_id, count = self._reservations.pop(future)
+        self._reserved[telegram_id] -= count
+        if self._reserved[telegram_id] <= 0:
+            del self._reserved[telegram_id]
+
+    async def get_daily_count(self, telegram_id: str) -> int:
+        """Media processed by the user today (UTC), including unflushed events."""
+        today = utc_now().date()
+        key = (telegram_id, today)
+        if key not in self._daily_counts:
+            since = datetime.combine(today, datetime.min.time())
+            async with self._flush_lock:
+                async with get_async_session() as db:
+                    count = await count_usage_since(db, telegram_id, since)
+                count += sum(1 for event in self._buffer
+                             if event['telegram_id'] == telegram_id and event['processed_at'] >= since)
+            self._daily_counts[key] = count
+            while len(self._daily_counts) > config.SETTINGS_CACHE_SIZE:
+                self._daily_counts.popitem(last=False)
+        return self._daily_counts[key]
+
+    async def flush(self):
+        async with self._flush_lock:
+            events, self._buffer = self._buffer, []
+            if not events:
+                return
+            try:
+                async with get_async_session() as db:
+                    user_ids = await get_user_ids(db, list({e['telegram_id'] for e in events}))
+                    rows = [
+                        {
+                            'user_id': user_ids[e['telegram_id']],
+                            'media_type': e['media_type'],
+                            'file_size': e['file_size'],
+                            'processed_at': e['processed_at'],
+                        }
+                        for e in events if e['telegram_id'] in user_ids
+                    ]
+                    await insert_usage(db, rows)
+                self.flushed += len(rows)
+            except Exception as e:
+                # Keep the events for the next attempt, up to a bounded backlog
+                logger.error(f"Error flushing usage records: {e}")
+                self._buffer = (events + self._buffer)[-config.USAGE_MAX_BACKLOG:]
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
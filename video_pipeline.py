@@ -0,0 +1,113 @@
+import queue
+import threading
+import time
+import numpy as np
+import config
+
+_STOP = object()
+
+
+class PipelineStopped(Exception):
+    """Another stage failed, so this one gave up."""
+
+
+class FramePipeline:
+    """Overlaps decode, blend and encode of an OpenCV video on three threads.
+
+    Frames live in a fixed ring of preallocated NumPy buffers that circulate
+    decode -> blend -> encode -> decode, so no frame is allocated per read.
+    OpenCV releases the GIL while decoding and encoding, which lets the
+    stages really run at the same time. Per-stage busy time is collected in
+    ``timings``.
+    """
+
+    def __init__(self, cap, writer, blend, frame_size: tuple, ring_size: int = None):
+        width, height = frame_size
+        self.cap = cap
+        self.writer = writer
+        self.blend = blend
+        self.ring_size = max(2, ring_size or config.VIDEO_PIPELINE_RING_SIZE)
+        self._free = queue.Queue()
+        for _ in range(self.ring_size):
+            self._free.put(np.empty((height, width, 3), dtype=np.uint8))
+        self._decoded = queue.Queue(maxsize=self.ring_size)
+        self._blended = queue.Queue(maxsize=self.ring_size)
+        self._stop = threading.Event()
+        self._error = None
+        self.timings = {'decode': 0.0, 'blend': 0.0, 'encode': 0.0, 'frames': 0}
+
+    def run(self) -> dict:
+        """Process the whole video and return the per-stage timings."""
+        threads = [
+            threading.Thread(target=self._stage, args=(self._decode,), name="video-decode", daemon=True),
+            threading.Thread(target=self._stage, args=(self._blend,), name="video-blend", daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        self._stage(self._encode)
+        for thread in threads:
+            thread.join()
+        if self._error is not None:
+            raise self._error
+        return self.timings
+
+    def _stage(self, body):
+        try:
+            body()
+        except PipelineStopped:
+            pass
+        except Exception as e:
+            if self._error is None:
+                self._error = e
+            self._stop.set()
+
+    def _get(self, q):
+        while True:
+            if self._stop.is_set():
+                raise PipelineStopped()
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+    def _put(self, q, item):
+        while True:
+            if self._stop.is_set():
+                raise PipelineStopped()
+            try:
+                return q.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+
+    def _decode(self):
+        while True:
+            buffer = self._get(self._free)
+            start = time.perf_counter()
+            ret, frame = self.cap.read(buffer)
+            self.timings['decode'] += time.perf_counter() - start
+            if not ret:
+                self._put(self._decoded, _STOP)
+                return
+            self._put(self._decoded, frame)
+
+    def _blend(self):
+        while True:
+            frame = self._get(self._decoded)
+            if frame is _STOP:
+                self._put(self._blended, _STOP)
+                return
+            start = time.perf_counter()
+            self.blend(frame)
+            self.timings['blend'] += time.perf_counter() - start
+            self._put(self._blended, frame)
+
+    def _encode(self):
+        while True:
+            frame = self._get(self._blended)
+            if frame is _STOP:
+                return
+            start = time.perf_counter()
+            self.writer.write(frame)
+            self.timings['encode'] += time.perf_counter() - start
+            self.timings['frames'] += 1
+            self._put(self._free, frame)
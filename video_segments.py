@@ -0,0 +1,110 @@
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from ffmpeg_engine import FFmpegError, is_audio_copy_error, render_video_ffmpeg, run_ffmpeg
+import config
+
+logger = logging.getLogger(__name__)
+
+
+def probe_duration(path: str) -> float:
+    """Container duration in seconds, or 0.0 if ffprobe can't tell.
+
+    A missing or failing ffprobe also gives 0.0, so the video is rendered
+    in a single pass instead of failing.
+    """
+    try:
+        result = subprocess.run(
+            [config.FFPROBE_BINARY, "-v", "error", "-show_entries", "format=duration",
+             "-of", "default=noprint_wrappers=1:nokey=1", path],
+            capture_output=True, text=True, check=True, timeout=config.FFMPEG_TIMEOUT or None,
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(f"ffprobe failed, rendering {path} in one pass: {e}")
+        return 0.0
+    try:
+        return float(result.stdout.strip())
+    except ValueError:
+        return 0.0
+
+
+def split_segments(input_path: str, segment_dir: str, segment_time: float) -> list:
+    """Split a video into keyframe-aligned segments without re-encoding."""
+    pattern = os.path.join(segment_dir, "in_%04d.mp4")
+    run_ffmpeg([
+        config.FFMPEG_BINARY, "-hide_banner", "-loglevel", "error", "-y",
+        "-i", input_path,
+        "-map", "0:v:0", "-map", "0:a:0?", "-c", "copy",
+        "-f", "segment", "-segment_time", f"{segment_time:.3f}", "-reset_timestamps", "1",
+        pattern,
+    ])
+    return sorted(
+        os.path.join(segment_dir, name) for name in os.listdir(segment_dir)
+        if name.startswith("in_")
+    )
+
+
+def concat_segments(segment_paths: list, output_path: str) -> str:
+    """Join segments with the concat demuxer, copying the streams."""
+    list_path = os.path.join(os.path.dirname(segment_paths[0]), "segments.txt")
+    with open(list_path, "w") as f:
+        for path in segment_paths:
+            f.write(f"file '{os.path.abspath(path)}'\n")
+    run_ffmpeg([
+        config.FFMPEG_BINARY, "-hide_banner", "-loglevel", "error", "-y",
+        "-f", "concat", "-safe", "0", "-i", list_path,
+        "-c", "copy", "-movflags", "+faststart",
+        output_path,
+    ])
+    return output_path
+
+
+def render_video_segmented(input_path: str, output_path: str, stamp, position: str,
+                           segments: int = None) -> str:
+    """Watermark a video as parallel segments and join them losslessly.
+
+    The input is cut at keyframes into about `segments` pieces, each piece
+    is watermarked by its own ffmpeg process (so the pieces use separate
+    cores), and the encoded pieces are concatenated with stream copy.
+    Videos shorter than VIDEO_SEGMENT_MIN_DURATION are rendered in one go,
+    and so are videos whose audio can't be stream-copied into the segments:
+    the single pass can re-encode it to AAC. Every segment copies the audio,
+    so all of them share one codec and can be concatenated.
+    """
+    segments = segments or config.VIDEO_SEGMENTS
+    duration = probe_duration(input_path)
+    if segments < 2 or duration < config.VIDEO_SEGMENT_MIN_DURATION:
+        return render_video_ffmpeg(input_path, output_path, stamp, position)
+
+    segment_dir = tempfile.mkdtemp(prefix="segments_", dir=config.TEMP_DIR)
+    try:
+        try:
+            inputs = split_segments(input_path, segment_dir, duration / segments)
+        except FFmpegError as e:
+            logger.warning(f"Could not split {input_path}, rendering in one pass: {e}")
+            return render_video_ffmpeg(input_path, output_path, stamp, position)
+        outputs = [os.path.join(segment_dir, "out_" + os.path.basename(path)[3:]) for path in inputs]
+        workers = min(len(inputs), segments)
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        logger.info(f"Rendering {input_path} as {len(inputs)} segments, {threads} threads each")
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="segment") as pool:
+                # The threads only wait on ffmpeg subprocesses
+                list(pool.map(
+                    lambda paths: render_video_ffmpeg(paths[0], paths[1], stamp, position,
+                                                      threads=threads, audio_codec="copy"),
+                    zip(inputs, outputs),
+                ))
+        except FFmpegError as e:
+            if not is_audio_copy_error(e):
+                raise
+            logger.warning(f"Segment audio copy failed, rendering {input_path} in one pass: {e}")
+            return render_video_ffmpeg(input_path, output_path, stamp, position)
+
+        return concat_segments(outputs, output_path)
+    finally:
+        shutil.rmtree(segment_dir, ignore_errors=True)
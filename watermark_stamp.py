@@ -0,0 +1,136 @@
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw
+import config
+
+
+class TextStamp:
+    """Watermark text rendered once onto a tight transparent RGBA image.
+
+    ``offset`` is the textbbox origin of the glyphs, so pasting the stamp at
+    (x + offset[0], y + offset[1]) matches ImageDraw.text((x, y), ...).
+    ``rgb`` and ``mask`` are the colour and alpha split out once, ready for
+    Image.paste(rgb, box, mask) onto an RGB image.
+    """
+
+    def __init__(self, text: str, font, color: tuple):
+        bbox = ImageDraw.Draw(Image.new('RGBA', (1, 1))).textbbox((0, 0), text, font=font)
+        self.width = max(1, int(bbox[2] - bbox[0]))
+        self.height = max(1, int(bbox[3] - bbox[1]))
+        self.offset = (int(bbox[0]), int(bbox[1]))
+        self.image = Image.new('RGBA', (self.width, self.height), (0, 0, 0, 0))
+        ImageDraw.Draw(self.image).text((-bbox[0], -bbox[1]), text, font=font, fill=color)
+        self.rgb = self.image.convert('RGB')
+        self.mask = self.image.getchannel('A')
+
+    @property
+    def nbytes(self) -> int:
+        # RGBA image plus the RGB and mask copies
+        return self.width * self.height * 8
+
+
+class StampCache:
+    """LRU cache of TextStamps bounded by their total pixel bytes."""
+
+    def __init__(self, max_bytes: int = None):
+        self.max_bytes = config.STAMP_CACHE_BYTES if max_bytes is None else max_bytes
+        self._stamps = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, factory) -> TextStamp:
+        """Return the stamp for key, building it with factory() on a miss."""
+        with self._lock:
+            stamp = self._stamps.get(key)
+            if stamp is not None:
+                self._stamps.move_to_end(key)
+                self.hits += 1
+                return stamp
+            self.misses += 1
+
+        stamp = factory()
+        if stamp.nbytes > self.max_bytes:
+            return stamp
+
+        with self._lock:
+            if key not in self._stamps:
+                self._stamps[key] = stamp
+                self.current_bytes += stamp.nbytes
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._stamps.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+                self.evictions += 1
+        return stamp
+
+    def clear(self):
+        with self._lock:
+            self._stamps.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self._stamps),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class VideoStamp:
+    """Pre-rendered watermark for OpenCV frames.
+
+    The text mask is drawn once and reduced to the bounding box of its
+    drawn pixels, so each frame only blends that small region in place:
+
+        roi = roi * (1 - a) + color * a
+
+    where ``a`` is the anti-aliased text coverage scaled by the opacity.
+    This gives the same result as drawing the text on a full copy of the
+    frame and blending the two with cv2.addWeighted.
+    """
+
+    def __init__(self, text: str, org: tuple, font: int, font_scale: float,
+                 color: tuple, thickness: int, opacity: int, frame_size: tuple):
+        width, height = frame_size
+
+        # Draw the text once on a frame-sized canvas, so glyphs are clipped
+        # (and skipped past the right edge) exactly as cv2.putText does on
+        # the frame itself, then shrink it to the drawn pixels
+        mask = np.zeros((height, width), dtype=np.uint8)
+        cv2.putText(mask, text, org, font, font_scale, 255, thickness, cv2.LINE_AA)
+        rows = np.flatnonzero(mask.any(axis=1))
+        cols = np.flatnonzero(mask.any(axis=0))
+        self.empty = len(rows) == 0
+        if self.empty:
+            self.box = (0, 0, 0, 0)
+            return
+
+        x0, y0 = int(cols[0]), int(rows[0])
+        x1, y1 = int(cols[-1]) + 1, int(rows[-1]) + 1
+        self.box = (x0, y0, x1, y1)
+        mask = mask[y0:y1, x0:x1]
+        alpha = mask.astype(np.float32) * (opacity / 255.0 / 255.0)
+        self.alpha = alpha[:, :, None]
+        self.inv_alpha = 1.0 - self.alpha
+        self.premultiplied = np.asarray(color, dtype=np.float32)[None, None, :] * self.alpha
+        self._scratch = np.empty(self.premultiplied.shape, dtype=np.float32)
+
+    def apply(self, frame: np.ndarray) -> np.ndarray:
+        """Blend the stamp into frame in place and return it."""
+        if self.empty:
+            return frame
+        x0, y0, x1, y1 = self.box
+        roi = frame[y0:y1, x0:x1]
+        scratch = self._scratch
+        np.multiply(roi, self.inv_alpha, out=scratch)
+        scratch += self.premultiplied
+        scratch += 0.5
+        np.copyto(roi, scratch, casting='unsafe')
+        return frame
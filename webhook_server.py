@@ -0,0 +1,84 @@
+import asyncio
+import hmac
+import logging
+import signal
+from aiohttp import web
+from telegram import Update
+import config
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def create_webhook_app(application, secret_token: str = None, path: str = None) -> web.Application:
+    """aiohttp app that feeds Telegram webhook requests into the application.
+
+    Requests without the matching secret token header are rejected, so only
+    Telegram (which echoes the token given to setWebhook) can post updates.
+    A secret is required: without one anybody who finds the URL could post
+    updates as any user. The handler only queues the update and answers at
+    once; the application processes it in the background.
+    """
+    secret_token = secret_token or config.WEBHOOK_SECRET_TOKEN
+    if not secret_token:
+        raise ValueError("WEBHOOK_SECRET_TOKEN environment variable is required in webhook mode")
+    path = path or config.WEBHOOK_PATH
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ""), secret_token
+        ):
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        await application.update_queue.put(Update.de_json(data, application.bot))
+        return web.Response()
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({'status': 'ok', 'running': application.running})
+
+    app = web.Application(client_max_size=config.WEBHOOK_MAX_BODY_SIZE)
+    app.router.add_post(path, handle_update)
+    app.router.add_get("/healthz", health)
+    return app
+
+
+async def run_webhook(application, allowed_updates: list = None):
+    """Run the bot behind the local webhook server until SIGINT/SIGTERM.
+
+    Run a single instance: conversation state (user_data, pending albums),
+    the caches, the job scheduler and the per-user locks all live in this
+    process's memory, so replicas behind a load balancer would each see
+    only part of a user's updates.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    runner = web.AppRunner(create_webhook_app(application))
+    async with application:
+        # Only run_polling/run_webhook call these hooks by themselves
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await runner.setup()
+        await web.TCPSite(runner, config.WEBHOOK_LISTEN, config.WEBHOOK_PORT).start()
+        if config.WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=config.WEBHOOK_URL.rstrip("/") + config.WEBHOOK_PATH,
+                secret_token=config.WEBHOOK_SECRET_TOKEN,
+                allowed_updates=allowed_updates,
+                max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+            )
+        logger.info(f"Webhook server listening on {config.WEBHOOK_LISTEN}:{config.WEBHOOK_PORT}{config.WEBHOOK_PATH}")
+        try:
+            await stop.wait()
+        finally:
+            await runner.cleanup()
+            await application.stop()
+            if application.post_shutdown:
+                await application.post_shutdown(application)